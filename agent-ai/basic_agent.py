@@ -1,33 +1,179 @@
+import hashlib
+import json
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
 
 load_dotenv()
 
+MODEL = "gpt-3.5-turbo"
+MAX_TOKENS = 100
+# Respuestas guardadas en memoria (LRU) y en disco para no repetir preguntas al modelo
+CACHE_SIZE = 256
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "responses_cache.json")
+# Preguntas enviadas a la vez en generate_responses
+MAX_WORKERS = 4
+
+def normalize_prompt(prompt: str) -> str:
+    """Normaliza la pregunta para la caché: sin espacios repetidos ni diferencias de mayúsculas."""
+    return " ".join(prompt.split()).lower()
+
+class OpenAIBackend:
+    """Backend que llama a la API de OpenAI. Cualquier objeto con complete y stream sirve como backend."""
+
+    def __init__(self, api_key: str, model: str = MODEL, max_tokens: int = MAX_TOKENS):
+        from openai import OpenAI
+
+        self.model = model
+        self.max_tokens = max_tokens
+        self.client = OpenAI(api_key=api_key)
+
+    def complete(self, prompt: str) -> str:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=self.max_tokens
+        )
+        return response.choices[0].message.content
+
+    def stream(self, prompt: str):
+        """Devuelve la respuesta por partes según la genera el modelo."""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=self.max_tokens,
+            stream=True
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+class ResponseCache:
+    """Caché LRU en memoria respaldada por un json en disco, segura entre hilos."""
+
+    def __init__(self, path: str = CACHE_PATH, max_size: int = CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            value = self._load_disk().get(key)
+            if value is not None:
+                self._remember(key, value)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._remember(key, value)
+            if self.path:
+                disk = self._load_disk()
+                disk[key] = value
+                temporary_path = f"{self.path}.tmp"
+                with open(temporary_path, "w", encoding="utf-8") as cache_file:
+                    json.dump(disk, cache_file, ensure_ascii=False)
+                os.replace(temporary_path, self.path)
+
+    def _remember(self, key: str, value: str):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def _load_disk(self) -> dict:
+        # El json se lee una sola vez, la primera vez que no se encuentra algo en memoria
+        if self._disk is None:
+            self._disk = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as cache_file:
+                        self._disk = json.load(cache_file)
+                except (OSError, ValueError) as e:
+                    print(f"No se pudo leer la caché {self.path}: {e}")
+        return self._disk
+
 class OpenAIAgent:
-    def __init__(self):
+    def __init__(self, backend=None, cache: ResponseCache = None, model: str = MODEL):
         """
         Inicializa el agente con la API de OpenAI
+
+        :param backend: objeto con complete(prompt) y stream(prompt), por defecto OpenAIBackend. Permite
+            probar la caché y los lotes con un backend local sin conexión.
+        :param cache: caché de respuestas, por defecto en memoria y en responses_cache.json.
         """
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            raise ValueError("API_KEY no encontrada en el archivo .env")
-        
-        self.client = OpenAI(api_key=self.api_key)
+        if backend is None:
+            self.api_key = os.getenv("OPENAI_API_KEY")
+            if not self.api_key:
+                raise ValueError("API_KEY no encontrada en el archivo .env")
+            backend = OpenAIBackend(self.api_key, model)
+
+        self.backend = backend
+        self.model = model
+        self.cache = cache if cache is not None else ResponseCache()
 
     def generate_response(self, user_input: str) -> str:
-        """Genera respuesta usando la API de OpenAI"""
+        """Genera respuesta usando la API de OpenAI, o la guardada si ya se hizo la misma pregunta"""
+        prompt = user_input.strip()
+        key = self.cache.key(self.model, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": user_input.strip()}],
-                max_tokens=100
-            )
-            return response.choices[0].message.content
-            
+            response = self.backend.complete(prompt)
         except Exception as e:
+            # Los errores no se guardan en la caché
             return f"Error en la API: {str(e)}"
 
+        self.cache.set(key, response)
+        return response
+
+    def generate_responses(self, prompts: list, max_workers: int = MAX_WORKERS) -> list:
+        """
+        Genera las respuestas de una lista de preguntas. Las preguntas repetidas (una vez normalizadas)
+        se envían una sola vez y las distintas se envían en paralelo.
+
+        :return: respuestas en el mismo orden que prompts.
+        """
+        unique_prompts = {}
+        for prompt in prompts:
+            unique_prompts.setdefault(normalize_prompt(prompt), prompt)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = dict(zip(unique_prompts, executor.map(self.generate_response, unique_prompts.values())))
+        return [responses[normalize_prompt(prompt)] for prompt in prompts]
+
+    def stream_response(self, user_input: str):
+        """Devuelve la respuesta por partes según llega; si ya está en caché se devuelve completa."""
+        prompt = user_input.strip()
+        key = self.cache.key(self.model, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        try:
+            for part in self.backend.stream(prompt):
+                parts.append(part)
+                yield part
+        except Exception as e:
+            yield f"Error en la API: {str(e)}"
+            return
+
+        self.cache.set(key, "".join(parts))
+
     def run(self):
         """Ejecuta el agente en modo interactivo"""
         print("\nAgent OpenAI iniciado. Escribe 'exit' para salir\n")
@@ -35,10 +181,12 @@ class OpenAIAgent:
             user_input = input("Tú: ")
             if user_input.lower() == 'exit':
                 break
-            
-            response = self.generate_response(user_input)
-            print(f"\nAgent: {response}\n")
+
+            print("\nAgent: ", end="", flush=True)
+            for part in self.stream_response(user_input):
+                print(part, end="", flush=True)
+            print("\n")
 
 if __name__ == "__main__":
     agent = OpenAIAgent()
-    agent.run()
\ No newline at end of file
+    agent.run()
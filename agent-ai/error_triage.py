@@ -0,0 +1,180 @@
+"""
+Triage por lotes de los archivos de errores de los loaders.
+
+Agrupa los mensajes de error por plantilla (sustituyendo matrículas, nombres, ids, fechas, importes, emails
+y textos entre comillas simples, conservando los códigos de estado HTTP) y envía al modelo una sola pregunta por grupo, así un archivo con miles
+de filas cuesta tantas llamadas como errores distintos tenga. Las respuestas quedan en la caché del agente.
+
+Uso:
+    python3 error_triage.py error/archivo_map_error.xlsx [otro_archivo.csv ...] [--top 20] [--dry-run]
+"""
+import argparse
+import os
+import re
+from collections import Counter
+
+import pandas as pd
+
+# Columnas con el mensaje de error según el loader que generó el archivo
+ERROR_COLUMNS = ["error", "map_error", "Error"]
+# Grupos que se envían al modelo, de más a menos frecuente
+DEFAULT_TOP = 20
+EXAMPLES_PER_CLUSTER = 3
+
+# Campos con el mensaje útil de los errores con forma de diccionario (el ValueError de calculate_totals o
+# el body json de las respuestas del API), por orden de preferencia
+DETAIL_KEYS = ["message", "detail", "error"]
+DETAIL_PATTERN = r"""(['"]){key}\1\s*:\s*\[?\s*(?:'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)")"""
+# Códigos de estado HTTP que se conservan en la plantilla, así un 400 y un 500 no acaban en el mismo grupo
+STATUS_CODE_PATTERN = re.compile(
+    r"(?:\bError:?|\berror code|\bestatus devuelto|\bstatus(?:_?code)?['\"]?\s*[:=]?)\s*,?\s*([1-5]\d{2})\b",
+    re.IGNORECASE,
+)
+
+# Sustituciones para obtener la plantilla del mensaje, se aplican en este orden
+TEMPLATE_PATTERNS = [
+    # Mensajes "... con la placa X no existe" de los loaders, el valor puede tener espacios y no tener dígitos
+    (
+        re.compile(r"\b(con (?:la|el) (?:placa|número|numero|nombre|código|codigo)) .+?(?= y (?:el|la) | no existen?\b)"),
+        r"\1 <valor>",
+    ),
+    # Valores entre comillas simples, no las claves de un diccionario
+    (re.compile(r"'[^']*'(?!\s*:)"), "<texto>"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"https?://\S+"), "<url>"),
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.IGNORECASE), "<uuid>"),
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}(?:[T ][\d:.]+Z?)?\b|\b\d{1,2}/\d{1,2}/\d{2,4}\b"), "<fecha>"),
+    # Importes, con signo para que los negativos no formen otro grupo
+    (re.compile(r"(?<![\w-])-?\d+(?:[.,]\d+)*\b(?![\w-])"), "<valor>"),
+    # Matrículas, códigos e ids: cualquier palabra con al menos un dígito
+    (re.compile(r"\b[\w-]*\d[\w-]*\b"), "<valor>"),
+]
+
+PROMPT_TEMPLATE = (
+    "Eres soporte técnico de Pulpo, una aplicación de gestión de flotas. Al cargar datos masivamente con "
+    "la API aparece este error en varias filas (<valor>, <fecha>, <texto>... sustituyen los datos de cada "
+    "fila):\n\n{template}\n\nExplica en dos o tres frases la causa más probable y cómo corregir las filas."
+)
+
+def error_detail(message: str) -> str:
+    """
+    Si el error tiene forma de diccionario con un mensaje (message, detail o error), devuelve el texto
+    anterior al diccionario (por ejemplo "Error: 400 ") seguido de ese mensaje; si no, el mensaje tal cual.
+    """
+    start = message.find("{")
+    if start == -1:
+        return message
+    for key in DETAIL_KEYS:
+        match = re.search(DETAIL_PATTERN.format(key=key), message[start:])
+        if match:
+            detail = match.group(2) if match.group(2) is not None else match.group(3)
+            return message[:start] + detail
+    return message
+
+def apply_template_patterns(text: str) -> str:
+    for pattern, placeholder in TEMPLATE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+def error_template(message: str) -> str:
+    """Plantilla del mensaje de error, igual para todas las filas con el mismo error."""
+    text = error_detail(" ".join(str(message).split()))
+    # Las sustituciones se aplican entre los códigos de estado, que se dejan sin cambiar
+    parts = []
+    last = 0
+    for match in STATUS_CODE_PATTERN.finditer(text):
+        parts.append(apply_template_patterns(text[last:match.start(1)]))
+        parts.append(match.group(1))
+        last = match.end(1)
+    parts.append(apply_template_patterns(text[last:]))
+    return "".join(parts)
+
+def read_errors(file_path: str, column: str = None) -> list:
+    """Lee los mensajes de error no vacíos de un archivo csv o xlsx."""
+    if file_path.endswith(".csv"):
+        df = pd.read_csv(file_path, dtype=str, keep_default_na=False)
+    elif file_path.endswith((".xlsx", ".xls")):
+        df = pd.read_excel(file_path, dtype=str, keep_default_na=False)
+    else:
+        raise ValueError(f"Formato no soportado: {file_path}")
+
+    columns = [column] if column else ERROR_COLUMNS
+    error_column = next((name for name in columns if name in df.columns), None)
+    if error_column is None:
+        raise ValueError(f"El archivo {file_path} no tiene ninguna de las columnas {', '.join(columns)}")
+    return [message for message in df[error_column].tolist() if message.strip()]
+
+def cluster_errors(messages: list) -> list:
+    """
+    Agrupa los mensajes por plantilla.
+
+    :return: grupos ordenados de más a menos frecuente, con template, count y examples.
+    """
+    counts = Counter()
+    examples = {}
+    for message in messages:
+        template = error_template(message)
+        counts[template] += 1
+        template_examples = examples.setdefault(template, [])
+        if len(template_examples) < EXAMPLES_PER_CLUSTER and message not in template_examples:
+            template_examples.append(message)
+
+    return [
+        {"template": template, "count": count, "examples": examples[template]}
+        for template, count in counts.most_common()
+    ]
+
+def triage(clusters: list, agent) -> list:
+    """Pregunta al agente por cada grupo, en paralelo y usando su caché."""
+    prompts = [PROMPT_TEMPLATE.format(template=cluster["template"]) for cluster in clusters]
+    responses = agent.generate_responses(prompts)
+    return [{**cluster, "response": response} for cluster, response in zip(clusters, responses)]
+
+def save_report(clusters: list, total: int, output_path: str):
+    rows = [
+        {
+            "plantilla": cluster["template"],
+            "filas": cluster["count"],
+            "porcentaje": round(cluster["count"] * 100 / total, 2),
+            "ejemplos": "\n".join(cluster["examples"]),
+            "respuesta": cluster.get("response", ""),
+        }
+        for cluster in clusters
+    ]
+    pd.DataFrame(rows).to_csv(output_path, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Agrupa los errores de los loaders y pide al agente una explicación por grupo.")
+    parser.add_argument("files", nargs="+", help="Archivos de errores csv o xlsx.")
+    parser.add_argument("--column", help=f"Columna con el error, por defecto la primera de {', '.join(ERROR_COLUMNS)}.")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="Grupos más frecuentes que se envían al modelo.")
+    parser.add_argument("--output", default="triage_errores.csv", help="Reporte csv con los grupos y las respuestas.")
+    parser.add_argument("--dry-run", action="store_true", help="Solo agrupa los errores, sin llamar al modelo.")
+    args = parser.parse_args()
+
+    messages = []
+    for file_path in args.files:
+        messages.extend(read_errors(file_path, args.column))
+    if not messages:
+        print("No se encontraron errores en los archivos.")
+        return
+
+    clusters = cluster_errors(messages)
+    print(f"{len(messages)} errores agrupados en {len(clusters)} plantillas")
+    selected = clusters[:args.top]
+
+    if not args.dry_run:
+        from basic_agent import OpenAIAgent
+
+        selected = triage(selected, OpenAIAgent())
+
+    for cluster in selected:
+        print(f"\n[{cluster['count']}] {cluster['template']}")
+        if cluster.get("response"):
+            print(f"  -> {cluster['response']}")
+
+    save_report(selected, len(messages), args.output)
+    print(f"\nReporte guardado en {os.path.abspath(args.output)}")
+
+if __name__ == "__main__":
+    main()
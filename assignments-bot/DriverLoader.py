@@ -1,5 +1,8 @@
 import pandas as pd
 
+# Filas por lote al leer el archivo, cada lote se envía antes de leer el siguiente
+CHUNK_SIZE = 5000
+
 class DriverLoader:
     REQUIRED_COLUMNS = [
         "Conductor*",
@@ -10,7 +13,18 @@ class DriverLoader:
         "Hora Fin",
         "Matricula*"
     ]
-    
+
+    # Clave de cada columna en los diccionarios de asignación
+    COLUMN_KEYS = {
+        "Conductor*": "name",
+        "Email*": "email",
+        "Fecha inicio*": "start_date",
+        "Hora inicio*": "start_time",
+        "Fecha Fin": "end_date",
+        "Hora Fin": "end_time",
+        "Matricula*": "vehicle",
+    }
+
     def __init__(self, file_path):
         self.file_path = file_path
         self.data = None
@@ -19,14 +33,14 @@ class DriverLoader:
         """Carga el archivo y detecta si es CSV o XLSX."""
         try:
             if self.file_path.endswith('.csv'):
-                self.data = pd.read_csv(self.file_path, quotechar='"')  # Añadir quotechar si hay comillas
+                self.data = pd.read_csv(self.file_path, **self._csv_options())
             elif self.file_path.endswith('.xlsx'):
-                self.data = pd.read_excel(self.file_path)
+                self.data = pd.read_excel(self.file_path, dtype=str, keep_default_na=False)
             else:
                 raise ValueError("El archivo debe ser un CSV o XLSX.")
         except Exception as e:
             raise RuntimeError(f"Error al cargar el archivo: {e}")
-        
+
         # Limpiar espacios extra en los nombres de las columnas
         self.data.columns = self.data.columns.str.strip()
 
@@ -34,7 +48,7 @@ class DriverLoader:
         """Valida que el archivo tenga las columnas necesarias."""
         if self.data is None:
             raise ValueError("No se ha cargado ningún archivo.")
-        
+
         missing_columns = [col for col in self.REQUIRED_COLUMNS if col not in self.data.columns]
         if missing_columns:
             raise ValueError(f"Faltan las siguientes columnas en el archivo: {', '.join(missing_columns)}")
@@ -43,21 +57,42 @@ class DriverLoader:
         """Procesa los datos y retorna una lista de conductores."""
         if self.data is None:
             raise ValueError("No se ha cargado ningún archivo.")
-        
-        drivers = []
-        for _, row in self.data.iterrows():
+
+        return self._to_drivers(self.data)
+
+    def iter_batches(self, chunk_size=CHUNK_SIZE):
+        """
+        Lee el archivo por lotes de chunk_size filas y devuelve cada lote como una lista de conductores,
+        así el envío puede empezar sin esperar a leer todo el archivo. Los CSV se leen por partes; los
+        XLSX no se pueden leer por partes con pandas, se cargan enteros y se reparten en lotes.
+        """
+        if self.file_path.endswith('.csv'):
             try:
-                driver = {
-                    "name": str(row.get("Conductor*", "")).strip(),
-                    "email": str(row.get("Email*", "")).strip(),
-                    "start_date": str(row.get("Fecha inicio*", "")).strip(),
-                    "start_time": str(row.get("Hora inicio*", "")).strip(),
-                    "end_date": str(row.get("Fecha Fin", "")).strip() if pd.notna(row.get("Fecha Fin")) else "",
-                    "end_time": str(row.get("Hora Fin", "")).strip() if pd.notna(row.get("Hora Fin")) else "",
-                    "vehicle": str(row.get("Matricula*", "")).strip()
-                }
-                drivers.append(driver)
+                chunks = pd.read_csv(self.file_path, chunksize=chunk_size, **self._csv_options())
             except Exception as e:
-                print(f"Error al procesar fila: {row.to_dict()} - {e}")
-                continue
-        return drivers
+                raise RuntimeError(f"Error al cargar el archivo: {e}")
+
+            for chunk in chunks:
+                chunk.columns = chunk.columns.str.strip()
+                self.data = chunk
+                self.validate_columns()
+                yield self._to_drivers(chunk)
+        else:
+            self.load_file()
+            self.validate_columns()
+            for start in range(0, len(self.data), chunk_size):
+                yield self._to_drivers(self.data.iloc[start:start + chunk_size])
+
+    def _csv_options(self):
+        # Se lee todo como texto para no perder ceros a la izquierda ni convertir matrículas numéricas a float,
+        # quotechar por si hay comillas
+        return {"quotechar": '"', "dtype": str, "keep_default_na": False}
+
+    def _to_drivers(self, data):
+        """Limpia las columnas requeridas de una vez y construye los diccionarios de conductores."""
+        columns = {
+            key: data[column].fillna("").astype(str).str.strip().tolist()
+            for column, key in self.COLUMN_KEYS.items()
+        }
+        keys = list(columns)
+        return [dict(zip(keys, values)) for values in zip(*columns.values())]
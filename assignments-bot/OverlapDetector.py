@@ -0,0 +1,161 @@
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timezone
+
+# Las asignaciones sin fecha de fin siguen abiertas indefinidamente
+OPEN_END = datetime.max
+
+
+def parse_api_date(value):
+    """Convierte una fecha ISO 8601 del API (o del body de la asignación) a datetime UTC sin zona horaria."""
+    if not value:
+        return None
+    date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def format_interval(start, end):
+    end_label = "sin fecha de fin" if end == OPEN_END else end.strftime("%d/%m/%Y")
+    return f"{start.strftime('%d/%m/%Y')} - {end_label}"
+
+
+class OverlapDetector:
+    """
+    Detecta en local las asignaciones que se solapan para un mismo vehículo o conductor, tanto entre
+    las filas del archivo como con las asignaciones que ya existen en la cuenta, sin llamar al API.
+
+    Los intervalos son [inicio, fin) y una asignación sin fecha de fin se considera abierta hasta el
+    infinito. Cada comprobación ordena los intervalos una vez y usa búsqueda binaria, O(n log n).
+    """
+
+    KEYS = [("vehicle_id", "vehículo", "vehicleId"), ("user_id", "conductor", "userId")]
+
+    def __init__(self, existing_assignments=()):
+        """
+        :param existing_assignments: asignaciones devueltas por el API con id, vehicleId, userId,
+            startDate y endDate.
+        """
+        self.existing = {key: defaultdict(list) for key, _, _ in self.KEYS}
+        self.indexes = {key: {} for key, _, _ in self.KEYS}
+        for assignment in existing_assignments:
+            start = parse_api_date(assignment.get("startDate"))
+            if start is None:
+                continue
+            end = parse_api_date(assignment.get("endDate")) or OPEN_END
+            for key, _, api_key in self.KEYS:
+                if assignment.get(api_key) is not None:
+                    self.existing[key][assignment[api_key]].append(
+                        (start, end, f"la asignación existente {assignment.get('id')}")
+                    )
+
+        for key, intervals_by_id in self.existing.items():
+            for entity_id in intervals_by_id:
+                self._build_index(key, entity_id)
+
+    def add_assignments(self, assignments):
+        """
+        Añade como existentes asignaciones ya aceptadas (con el formato de find_conflicts), para que las
+        filas de los lotes siguientes del archivo se comparen también con ellas.
+        """
+        touched = set()
+        for assignment in assignments:
+            description = f"la fila {assignment['row_number']} del archivo"
+            for key, _, _ in self.KEYS:
+                if assignment.get(key) is not None:
+                    self.existing[key][assignment[key]].append(
+                        (assignment["start"], assignment["end"] or OPEN_END, description)
+                    )
+                    touched.add((key, assignment[key]))
+        for key, entity_id in touched:
+            self._build_index(key, entity_id)
+
+    def _build_index(self, key, entity_id):
+        """Ordena los intervalos del vehículo o conductor y guarda los inicios y el máximo acumulado de los fines."""
+        intervals = self.existing[key][entity_id]
+        intervals.sort(key=lambda interval: (interval[0], interval[1]))
+        starts = [start for start, _, _ in intervals]
+        max_ends = []
+        for position, (_, end, _) in enumerate(intervals):
+            if position == 0 or end > intervals[max_ends[-1]][1]:
+                max_ends.append(position)
+            else:
+                max_ends.append(max_ends[-1])
+        self.indexes[key][entity_id] = (starts, max_ends, intervals)
+
+    def find_conflicts(self, assignments):
+        """
+        :param assignments: lista de diccionarios con vehicle_id, user_id, start, end (None si no tiene
+            fin) y row_number (fila del archivo).
+        :return: diccionario {posición en assignments: motivo}. Si dos filas del archivo se solapan se
+            conserva la que empieza antes y se marca la otra.
+        """
+        conflicts = {}
+        # Un único recorrido cronológico que comprueba vehículo y conductor a la vez, así una fila
+        # rechazada por cualquiera de los dos no ocupa el intervalo del otro
+        accepted = {key: {} for key, _, _ in self.KEYS}
+        positions = sorted(range(len(assignments)), key=lambda position: (assignments[position]["start"], position))
+        for position in positions:
+            assignment = assignments[position]
+            start = assignment["start"]
+            end = assignment["end"] or OPEN_END
+
+            reason = None
+            for key, label, _ in self.KEYS:
+                entity_id = assignment.get(key)
+                if entity_id is None:
+                    continue
+                reason = self._find_conflict(key, label, entity_id, start, end, accepted[key].get(entity_id), assignments)
+                if reason is not None:
+                    break
+            if reason is not None:
+                conflicts[position] = reason
+                continue
+
+            for key, _, _ in self.KEYS:
+                entity_id = assignment.get(key)
+                if entity_id is None:
+                    continue
+                accepted_position = accepted[key].get(entity_id)
+                if accepted_position is None or end > (assignments[accepted_position]["end"] or OPEN_END):
+                    accepted[key][entity_id] = position
+        return conflicts
+
+    def _find_conflict(self, key, label, entity_id, start, end, accepted_position, assignments):
+        """
+        Motivo del solape de [start, end) con una asignación existente o con la fila aceptada del archivo
+        que termina más tarde para el mismo vehículo o conductor, o None si no se solapa.
+        """
+        existing_conflict = self._find_existing_conflict(key, entity_id, start, end)
+        if existing_conflict is not None:
+            existing_start, existing_end, description = existing_conflict
+            return (
+                f"Se solapa con {description} para el mismo {label} "
+                f"({format_interval(existing_start, existing_end)})"
+            )
+
+        if accepted_position is not None:
+            accepted = assignments[accepted_position]
+            accepted_end = accepted["end"] or OPEN_END
+            if start < accepted_end:
+                return (
+                    f"Se solapa con la fila {accepted['row_number']} del archivo para el mismo {label} "
+                    f"({format_interval(accepted['start'], accepted_end)})"
+                )
+        return None
+
+    def _find_existing_conflict(self, key, entity_id, start, end):
+        """Devuelve la asignación existente que se solapa con [start, end), o None."""
+        index = self.indexes[key].get(entity_id)
+        if index is None:
+            return None
+        starts, max_ends, intervals = index
+        # Solo pueden solaparse las que empiezan antes del fin, y de ellas basta la que termina más tarde
+        candidates = bisect_left(starts, end)
+        if candidates == 0:
+            return None
+        latest = intervals[max_ends[candidates - 1]]
+        if latest[1] > start:
+            return latest
+        return None
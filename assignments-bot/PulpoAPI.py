@@ -1,15 +1,44 @@
+import csv
+import logging
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import requests
 from dotenv import load_dotenv
 
 from DriverLoader import DriverLoader
+from OverlapDetector import OverlapDetector, parse_api_date
 
 # Cargar las variables de entorno
 load_dotenv()
 
+# Asignaciones en vuelo a la vez (una por vehículo) y ritmo máximo de peticiones al API
+MAX_IN_FLIGHT = int(os.getenv("ASSIGNMENTS_MAX_IN_FLIGHT", "5"))
+REQUESTS_PER_SECOND = float(os.getenv("ASSIGNMENTS_REQUESTS_PER_SECOND", "5"))
+
+# Listado de asignaciones existentes para detectar solapamientos antes de enviar
+ASSIGNMENTS_LIST_ENDPOINT = os.getenv("ASSIGNMENTS_LIST_ENDPOINT", "assignments/")
+ASSIGNMENTS_PAGE_SIZE = int(os.getenv("ASSIGNMENTS_PAGE_SIZE", "1000"))
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+RESULT_COLUMNS = [
+    "name",
+    "email",
+    "vehicle",
+    "start_date",
+    "start_time",
+    "end_date",
+    "end_time",
+    "userId",
+    "vehicleId",
+    "error",
+]
+
+logger = logging.getLogger(__name__)
+
 class PulpoAPI:
     def __init__(self):
         self._load_env()
@@ -37,34 +66,45 @@ class PulpoAPI:
             raise EnvironmentError("Una o más variables del entorno no están configuradas correctamente.")
 
     def get_users(self):
-        """Obtiene todos los usuarios de la API en una sola solicitud y filtra los que coinciden."""
+        """
+        Obtiene todos los usuarios de la API en una sola solicitud y los indexa por nombre y por email.
+
+        :return: {"by_name": {nombre: id}, "by_email": {email: id}}, si se repite un nombre o email se
+            conserva el primer usuario devuelto por la API.
+        """
         url = f"{self.base_url}{self.drivers_endpoint}?skip=0&take=1&userType=4"
         response = requests.get(url, headers=self.headers)
         response.raise_for_status()
         data = response.json()
 
         total_rows = data["_metadata"]["_total_rows"]
-        print(f"Total de usuarios: {total_rows}")
+        logger.info(f"Total de usuarios: {total_rows}")
 
         url = f"{self.base_url}{self.drivers_endpoint}?skip=0&take={total_rows}&userType=4"
         response = requests.get(url, headers=self.headers)
         response.raise_for_status()
 
         users = response.json()["list"]
-        user_ids = {}
+        users_index = {"by_name": {}, "by_email": {}}
 
         for user in users:
-            user_name = user.get("name", "").strip()
-            user_email = user.get("email", "").strip()
+            user_name = (user.get("name") or "").strip()
+            user_email = (user.get("email") or "").strip()
             user_id = user.get("id")
 
-            user_ids[user_id] = (user_name, user_email)
+            users_index["by_name"].setdefault(user_name, user_id)
+            users_index["by_email"].setdefault(user_email, user_id)
 
-        return user_ids
+        return users_index
 
     def get_vehicles(self):
-        """Obtiene los IDs de los vehículos que coinciden con 'name' o 'registrationNumberV2'."""
-        vehicles_ids = {}
+        """
+        Obtiene todos los vehículos de la API y los indexa por 'name' y por 'registrationNumberV2' sin guiones.
+
+        :return: {"by_name": {nombre: id}, "by_registration": {matrícula normalizada: id}}, si se repite
+            un valor se conserva el primer vehículo devuelto por la API.
+        """
+        vehicles_index = {"by_name": {}, "by_registration": {}}
 
         url = f"{self.base_url}{self.vehicles_endpoint}?skip=0&take=1"
         response = requests.get(url, headers=self.headers)
@@ -72,7 +112,7 @@ class PulpoAPI:
         data = response.json()
 
         total_vehicles = data["_metadata"]["_total_rows"]
-        print(f"Total de vehículos disponibles: {total_vehicles}")
+        logger.info(f"Total de vehículos disponibles: {total_vehicles}")
 
         url = f"{self.base_url}{self.vehicles_endpoint}?skip=0&take={total_vehicles}"
         response = requests.get(url, headers=self.headers)
@@ -83,33 +123,117 @@ class PulpoAPI:
         for vehicle in vehicles:
             vehicle_id = vehicle.get("id")
             vehicle_name = vehicle.get("name")
-            vehicle_registration = vehicle.get("registrationNumberV2", "").replace("-", "")
+            vehicle_registration = (vehicle.get("registrationNumberV2") or "").replace("-", "")
 
-            vehicles_ids[vehicle_id] = {
-                "name": vehicle_name,
-                "registrationNumberV2": vehicle_registration
-            }
+            if vehicle_name is not None:
+                vehicles_index["by_name"].setdefault(vehicle_name, vehicle_id)
+            if vehicle_registration:
+                vehicles_index["by_registration"].setdefault(vehicle_registration, vehicle_id)
 
-        return vehicles_ids
+        return vehicles_index
+
+    def get_assignments(self, page_size=ASSIGNMENTS_PAGE_SIZE):
+        """
+        Obtiene todas las asignaciones existentes de la cuenta, paginando con skip y take.
+
+        :return: lista de asignaciones con id, vehicleId, userId, startDate y endDate.
+        """
+        url = f"{self.base_url}{ASSIGNMENTS_LIST_ENDPOINT}"
+        assignments = []
+        skip = 0
+        total_rows = None
+
+        while total_rows is None or skip < total_rows:
+            response = requests.get(url, params={"skip": skip, "take": page_size}, headers=self.headers)
+            response.raise_for_status()
+            data = response.json()
+            total_rows = data["_metadata"]["_total_rows"]
+
+            page = data.get("list", data.get("assignments", []))
+            if not page:
+                break
+            assignments.extend(page)
+            skip += len(page)
+
+        logger.info(f"Total de asignaciones existentes: {len(assignments)}")
+        return assignments
 
     def post_assignment(self, vehicle_id, body):
         """
         Realiza un POST al endpoint de assignments.
+        Lanza ValueError con el estatus y la respuesta del API si la asignación no se crea.
         """
         # Limpiar el body eliminando los campos innecesarios
         body_cleaned = {key: value for key, value in body.items() if key not in ['vehicleId']}
         
         url = f"{self.base_url}{self.assignments_endpoint}{vehicle_id}"
         
-        try:
-            response = requests.post(url, json=body_cleaned, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error al realizar el POST: {e}")
-            print(f"URL del POST: {url}")
-            print(f"Body enviado: {body_cleaned}")
-            return None
+        response = requests.post(url, json=body_cleaned, headers=self.headers)
+        if not response.ok:
+            raise ValueError(f"Error {response.status_code} al crear la asignación: {response.text}")
+        return response.json()
+
+
+class RateLimiter:
+    """Espacia las peticiones para no superar requests_per_second entre todos los hilos."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def acquire(self):
+        if self.interval == 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ResultsWriter:
+    """
+    Guarda el resultado de cada asignación en dos csv, exitosas y fallidas, fila a fila y desde varios hilos.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        self.success_path = os.path.join(directory, f"asignaciones_ok_{timestamp}.csv")
+        self.failure_path = os.path.join(directory, f"asignaciones_error_{timestamp}.csv")
+        self.success_count = 0
+        self.failure_count = 0
+        self._lock = threading.Lock()
+        self._success_file = open(self.success_path, "w", newline="", encoding="utf-8")
+        self._failure_file = open(self.failure_path, "w", newline="", encoding="utf-8")
+        self._success_writer = csv.DictWriter(self._success_file, RESULT_COLUMNS, extrasaction="ignore")
+        self._failure_writer = csv.DictWriter(self._failure_file, RESULT_COLUMNS, extrasaction="ignore")
+        self._success_writer.writeheader()
+        self._failure_writer.writeheader()
+
+    def success(self, row, user_id, vehicle_id):
+        with self._lock:
+            self._success_writer.writerow({**row, "userId": user_id, "vehicleId": vehicle_id})
+            self._success_file.flush()
+            self.success_count += 1
+
+    def failure(self, row, error, user_id=None, vehicle_id=None):
+        with self._lock:
+            self._failure_writer.writerow({**row, "userId": user_id, "vehicleId": vehicle_id, "error": error})
+            self._failure_file.flush()
+            self.failure_count += 1
+
+    def close(self):
+        self._success_file.close()
+        self._failure_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 def convert_to_iso_format(date_str):
     """
@@ -149,91 +273,207 @@ def build_assignment_body(row, user_id, vehicle_id):
     # Asegurarse de que None se convierta en null para JSON
     return {key: (None if value is None else value) for key, value in body.items()}
 
-def process_assignments(file_data, user_ids, vehicles_data, api):
+def normalize_registration(matricula):
+    """Quita espacios y guiones de la matrícula, igual que registrationNumberV2."""
+    return matricula.replace(" ", "").replace("-", "")
+
+def find_vehicle_id(matricula, vehicles_index):
+    """Busca el vehículo primero por nombre exacto y luego por matrícula normalizada."""
+    vehicle_id = vehicles_index["by_name"].get(matricula)
+    if vehicle_id is None:
+        vehicle_id = vehicles_index["by_registration"].get(normalize_registration(matricula))
+    return vehicle_id
+
+def assignment_start(row):
+    """Fecha y hora de inicio de la asignación, para ordenar las asignaciones de un mismo vehículo."""
+    start = datetime.strptime(row["start_date"], "%d/%m/%Y")
+    for time_format in ("%H:%M", "%H:%M:%S"):
+        try:
+            start_time = datetime.strptime(row.get("start_time", ""), time_format)
+            return start.replace(hour=start_time.hour, minute=start_time.minute, second=start_time.second)
+        except ValueError:
+            continue
+    return start
+
+def resolve_assignment(row, row_number, users_index, vehicles_index, results, users_not_found):
     """
-    Procesa las asignaciones de conductores a vehículos y guarda los datos de usuarios no encontrados
-    junto con los bodies generados en un archivo 'User_Not_Exists.txt'.
+    Busca el usuario y el vehículo de la fila y construye su asignación. Si falta alguno o la fecha no es
+    válida guarda la fila como fallida y devuelve None.
     """
-    users_not_found = []
-    total_assignments = len(file_data)
-    processed_assignments = 0
-
-    for row in file_data:
-        conductor = row["name"].strip()
-        email = row["email"].strip()
-        matricula = row["vehicle"].strip()
-
-        # Buscar el userId
-        user_id = None
-        for uid, (name, user_email) in user_ids.items():
-            if name == conductor:  #user_email == email:
-                user_id = uid
-                break
+    conductor = row["name"].strip()
+    email = row["email"].strip()
+    matricula = row["vehicle"].strip()
 
-        if not user_id:
-            print(f"Error: No se encontró usuario para {conductor} ({email})")
-            
-            # Construir el body con datos vacíos ya que no hay usuario
-            body = build_assignment_body(row, None, None)
-            
-            users_not_found.append(f"Usuario: {conductor} ({email}) - Asignación no procesada: {body}\n")
-            continue
+    # Buscar el userId por nombre, users_index["by_email"] permite buscarlo por email
+    user_id = users_index["by_name"].get(conductor)
 
-        # Buscar el vehicleId
-        vehicle = None
-        for vehicle_id, vehicle_info in vehicles_data.items():
-            if matricula == vehicle_info["name"] or matricula.replace(" ", "").replace("-", "") == vehicle_info["registrationNumberV2"]:
-                vehicle = vehicle_info
-                vehicle_id = vehicle_id
-                break
+    if not user_id:
+        logger.error(f"No se encontró usuario para {conductor} ({email})")
 
-        if not vehicle:
-            print(f"Error: No se encontró vehículo para matrícula {matricula}")
-            continue
+        # Construir el body con datos vacíos ya que no hay usuario
+        body = build_assignment_body(row, None, None)
+
+        users_not_found.append(f"Usuario: {conductor} ({email}) - Asignación no procesada: {body}\n")
+        results.failure(row, "Usuario no encontrado")
+        return None
+
+    # Buscar el vehicleId
+    vehicle_id = find_vehicle_id(matricula, vehicles_index)
 
-        # Generar el body para la asignación
+    if vehicle_id is None:
+        logger.error(f"No se encontró vehículo para matrícula {matricula}")
+        results.failure(row, "Vehículo no encontrado", user_id)
+        return None
+
+    # Generar el body para la asignación
+    try:
         body = build_assignment_body(row, user_id, vehicle_id)
+        start = assignment_start(row)
+    except ValueError as e:
+        logger.error(f"Fecha inválida para {conductor} y vehículo {matricula}: {e}")
+        results.failure(row, f"Fecha inválida: {e}", user_id, vehicle_id)
+        return None
+
+    return {
+        "row": row,
+        "body": body,
+        "row_number": row_number,
+        "vehicle_id": vehicle_id,
+        "user_id": user_id,
+        # Se compara con las mismas fechas que recibirá el API
+        "start": parse_api_date(body["startDate"]),
+        "end": parse_api_date(body["endDate"]),
+        "sort_key": start,
+    }
 
-        # Realizar el POST para la asignación
-        try:
-            response = api.post_assignment(vehicle_id, body)
-            if response:
-                print(f"Asignación procesada para el usuario {conductor} y vehículo {matricula}")
-            else:
-                print(f"Error al procesar asignación para {conductor} y vehículo {matricula}")
-        except Exception as e:
-            print(f"Excepción al realizar el POST: {e}")
-
-        # Incrementar el contador de asignaciones procesadas
-        processed_assignments += 1
-        
-        # Mostrar barra de progreso
-        percentage = (processed_assignments / total_assignments) * 100
-        print(f"\rProcesando asignaciones: {processed_assignments}/{total_assignments} - {percentage:.2f}% completado", end="")
+def process_assignments(
+    batches,
+    users_index,
+    vehicles_index,
+    api,
+    existing_assignments=(),
+    max_in_flight=MAX_IN_FLIGHT,
+    requests_per_second=REQUESTS_PER_SECOND,
+):
+    """
+    Procesa las asignaciones de conductores a vehículos y guarda el resultado de cada fila en
+    results/asignaciones_ok_*.csv y results/asignaciones_error_*.csv. Los usuarios no encontrados
+    junto con los bodies generados se guardan además en 'User_Not_Exists.txt'.
+
+    :param batches: lotes de filas, como los de DriverLoader.iter_batches. Cada lote se envía antes de
+        leer el siguiente.
 
-        # Esperar 200ms antes de la siguiente petición
-        time.sleep(0.2)
+    Las filas que se solapan con una asignación existente, o con otra fila del archivo ya aceptada, para
+    el mismo vehículo o conductor no se envían y se guardan como fallidas con el motivo del solapamiento.
+    """
+    users_not_found = []
+    detector = OverlapDetector(existing_assignments)
+    rate_limiter = RateLimiter(requests_per_second)
+    row_number = 0
+    overlaps = 0
+
+    with ResultsWriter(RESULTS_DIR) as results:
+        for batch_number, batch in enumerate(batches, start=1):
+            assignments = []
+            for row in batch:
+                row_number += 1
+                assignment = resolve_assignment(
+                    row, row_number, users_index, vehicles_index, results, users_not_found
+                )
+                if assignment is not None:
+                    assignments.append(assignment)
+
+            conflicts = detector.find_conflicts(assignments)
+            overlaps += len(conflicts)
+            accepted = []
+            assignments_by_vehicle = {}
+            for position, assignment in enumerate(assignments):
+                row = assignment["row"]
+                if position in conflicts:
+                    logger.error(
+                        f"Asignación no enviada para {row['name']} y vehículo {row['vehicle']}: {conflicts[position]}"
+                    )
+                    results.failure(row, conflicts[position], assignment["user_id"], assignment["vehicle_id"])
+                    continue
+                accepted.append(assignment)
+                assignments_by_vehicle.setdefault(assignment["vehicle_id"], []).append(
+                    (assignment["sort_key"], row, assignment["body"])
+                )
+            # Los lotes siguientes también se comparan con las filas aceptadas de este
+            detector.add_assignments(accepted)
+
+            logger.info(f"Lote {batch_number}: {len(batch)} filas, {len(accepted)} asignaciones a enviar")
+            send_assignments(assignments_by_vehicle, api, results, max_in_flight, rate_limiter)
+
+        if overlaps:
+            logger.info(f"Asignaciones descartadas por solapamiento: {overlaps}")
+        logger.info(
+            f"Asignaciones exitosas: {results.success_count}, fallidas: {results.failure_count}"
+        )
+        logger.info(f"Resultados guardados en {results.success_path} y {results.failure_path}")
 
     # Guardar los usuarios no encontrados
     if users_not_found:
         with open("User_Not_Exists.txt", "w") as file:
             for entry in users_not_found:
                 file.write(entry)
-        print(f"\nSe guardaron los datos en 'User_Not_Exists.txt'")
+        logger.info("Se guardaron los datos en 'User_Not_Exists.txt'")
+
+def send_assignments(assignments_by_vehicle, api, results, max_in_flight, rate_limiter):
+    """
+    Envía las asignaciones con hasta max_in_flight vehículos en paralelo, al ritmo que marque
+    rate_limiter. Las asignaciones de un mismo vehículo se envían una tras otra
+    ordenadas por fecha de inicio, ya que el API rechaza asignaciones que se solapan.
+    """
+    total_assignments = sum(len(assignments) for assignments in assignments_by_vehicle.values())
+    progress = {"processed": 0}
+    progress_lock = threading.Lock()
+
+    def send_vehicle_assignments(vehicle_id, assignments):
+        # sorted es estable, las asignaciones con el mismo inicio conservan el orden del archivo
+        for _, row, body in sorted(assignments, key=lambda assignment: assignment[0]):
+            rate_limiter.acquire()
+            try:
+                api.post_assignment(vehicle_id, body)
+                results.success(row, body["userId"], vehicle_id)
+                logger.info(f"Asignación procesada para el usuario {row['name']} y vehículo {row['vehicle']}")
+            except Exception as e:
+                results.failure(row, str(e), body["userId"], vehicle_id)
+                logger.error(f"Error al procesar asignación para {row['name']} y vehículo {row['vehicle']}: {e}")
+
+            with progress_lock:
+                progress["processed"] += 1
+                percentage = (progress["processed"] / total_assignments) * 100
+                logger.info(
+                    f"Procesando asignaciones: {progress['processed']}/{total_assignments} - {percentage:.2f}% completado"
+                )
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = [
+            executor.submit(send_vehicle_assignments, vehicle_id, assignments)
+            for vehicle_id, assignments in assignments_by_vehicle.items()
+        ]
+        for future in as_completed(futures):
+            future.result()
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
     archivo = 'Chubb-Asginaciones-Conductores.csv'
     pulpo_api = PulpoAPI()
 
     loader = DriverLoader(archivo)
-    loader.load_file()
-    loader.validate_columns()
-    drivers_data = loader.process_data()
 
-    user_ids = pulpo_api.get_users()
-    vehicles_data = pulpo_api.get_vehicles()
+    users_index = pulpo_api.get_users()
+    vehicles_index = pulpo_api.get_vehicles()
+
+    try:
+        existing_assignments = pulpo_api.get_assignments()
+    except (requests.RequestException, KeyError, ValueError) as e:
+        logger.warning(f"No se pudieron obtener las asignaciones existentes, solo se revisarán solapamientos del archivo: {e}")
+        existing_assignments = []
 
-    process_assignments(drivers_data, user_ids, vehicles_data, pulpo_api)
+    # El archivo se lee por lotes mientras se envían las asignaciones
+    process_assignments(loader.iter_batches(), users_index, vehicles_index, pulpo_api, existing_assignments)
 
 
 if __name__ == "__main__":
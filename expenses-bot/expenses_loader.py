@@ -1,17 +1,43 @@
+import csv
+import hashlib
+import json
 import os
+import threading
+import time
 import requests
+import numpy as np
 import pandas as pd
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError
 from tqdm import tqdm
 from datetime import datetime
 from utils.expense_mapper import ExpenseMapper
 
+# Peticiones POST en vuelo a la vez, comparten un pool de conexiones del mismo tamaño
+MAX_IN_FLIGHT = int(os.getenv("EXPENSES_MAX_IN_FLIGHT", "8"))
+# Reintentos ante errores transitorios, con espera exponencial desde RETRY_BACKOFF_SECONDS
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 1
+# Solo se reintentan respuestas que indican que el gasto no se creó. Un 502 o 504 del gateway no lo
+# garantiza (el backend pudo guardar el gasto), así que quedan como fila fallida para revisarla
+RETRY_STATUS_CODES = {429, 503}
+REQUEST_TIMEOUT_SECONDS = 60
+ERROR_COLUMNS = ["fila", "status_code", "intentos", "error"]
+
+# Usuarios por página y vigencia de la copia local del mapeo email -> id de usuario
+USERS_PAGE_SIZE = 500
+USERS_CACHE_DIR = ".cache"
+USERS_CACHE_TTL_SECONDS = int(os.getenv("EXPENSES_USERS_CACHE_TTL_SECONDS", "3600"))
+
 class ExpensesLoader:
     def __init__(self, file_path: str):
         self.file_path = file_path
         self.api_url = "https://eu1.getpulpo.com/api/v1/scheduled-expenses/"
         self.users_api_url = "https://eu1.getpulpo.com/api/v1/users"
         self.token = self.load_api_token()
+        self.session = self.create_session()
         self.errors_dir = 'errors/'
         os.makedirs(self.errors_dir, exist_ok=True)
         
@@ -24,8 +50,15 @@ class ExpensesLoader:
             ]
         )
         self.logger = logging.getLogger()
-        
-        self.user_id_mapping = self.fetch_user_id_mapping()
+
+        self.token_valid, self.user_id_mapping = self.preflight()
+
+    def preflight(self):
+        """Valida el token y obtiene el mapeo de usuarios a la vez."""
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            token_valid = executor.submit(self.validate_token)
+            user_id_mapping = executor.submit(self.fetch_user_id_mapping)
+            return token_valid.result(), user_id_mapping.result()
 
     def load_api_token(self, env_file_path=".env"):
         try:
@@ -37,103 +70,156 @@ class ExpensesLoader:
         except FileNotFoundError:
             raise FileNotFoundError(f"El archivo {env_file_path} no se encuentra.")
 
+    def create_session(self, max_in_flight: int = MAX_IN_FLIGHT) -> requests.Session:
+        """Sesión con el token y un pool de conexiones reutilizables para todos los hilos."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({'Authorization': f'Bearer {self.token}'})
+        return session
+
     def validate_token(self) -> bool:
-        headers = {'Authorization': f'Bearer {self.token}'}
-        response = requests.get(self.api_url, headers=headers)
+        """Comprueba el token pidiendo una página de un solo gasto programado."""
+        try:
+            response = self.session.get(
+                self.api_url, params={"skip": 0, "take": 1}, timeout=REQUEST_TIMEOUT_SECONDS
+            )
+        except requests.RequestException as e:
+            self.logger.error(f"Error al validar el token: {e}")
+            return False
         return response.status_code == 200
 
-    def fetch_user_id_mapping(self):
+    def fetch_user_id_mapping(self, use_cache: bool = True):
+        """
+        Devuelve el mapeo email -> id de usuario. Se guarda en .cache/ por token y se reutiliza durante
+        USERS_CACHE_TTL_SECONDS; si no hay copia vigente se descarga por páginas en paralelo.
+        """
+        cache_path = os.path.join(
+            USERS_CACHE_DIR, f"users_{hashlib.sha256(self.token.encode()).hexdigest()[:16]}.json"
+        )
+        if use_cache and os.path.exists(cache_path):
+            if time.time() - os.path.getmtime(cache_path) < USERS_CACHE_TTL_SECONDS:
+                try:
+                    with open(cache_path, "r", encoding="utf-8") as cache_file:
+                        user_id_mapping = json.load(cache_file)
+                    self.logger.info(f"Usuarios leídos de {cache_path}: {len(user_id_mapping)}")
+                    return user_id_mapping
+                except (OSError, ValueError) as e:
+                    self.logger.warning(f"No se pudo leer {cache_path}, se descargan los usuarios: {e}")
+
         try:
-            headers = {'Authorization': f'Bearer {self.token}'}
-            
-            response = requests.get(f"{self.users_api_url}?skip=0&take=1", headers=headers)
-            response.raise_for_status()
-            total_rows = response.json().get('_metadata', {}).get('_total_rows', 0)
-            
+            users, total_rows = self.fetch_users_page(0)
             if total_rows == 0:
                 self.logger.warning("No se encontraron usuarios en la API.")
                 return {}
 
-            response = requests.get(f"{self.users_api_url}?skip=0&take={total_rows}", headers=headers)
-            response.raise_for_status()
-            users = response.json().get('list', [])
-            
-            user_id_mapping = {
-                user['email']: user['id']
-                for user in users
-                if user.get('email')
-            }
-            return user_id_mapping
-
+            with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT) as executor:
+                pages = executor.map(self.fetch_users_page, range(USERS_PAGE_SIZE, total_rows, USERS_PAGE_SIZE))
+                for page, _ in pages:
+                    users.extend(page)
         except requests.RequestException as e:
             self.logger.error(f"Error al obtener el mapeo de usuarios: {e}")
             return {}
 
+        user_id_mapping = {
+            user['email']: user['id']
+            for user in users
+            if user.get('email')
+        }
+
+        os.makedirs(USERS_CACHE_DIR, exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as cache_file:
+            json.dump(user_id_mapping, cache_file)
+        return user_id_mapping
+
+    def fetch_users_page(self, skip: int):
+        response = self.session.get(
+            self.users_api_url,
+            params={"skip": skip, "take": USERS_PAGE_SIZE},
+            timeout=REQUEST_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data.get('list', []), data.get('_metadata', {}).get('_total_rows', 0)
+
     def map_rows(self, data_frame: pd.DataFrame) -> list:
+        """
+        Mapea las filas por columnas: las fechas, importes y frecuencias se convierten una vez por valor
+        distinto y el tipo de impuesto, el de descuento y el total se calculan con numpy para todo el archivo.
+        """
         expense_mapper = ExpenseMapper()
-        mapped_rows = []
-
-        for _, row in data_frame.iterrows():
-            def convert_date(date_str):
-                if isinstance(date_str, str) and date_str.strip():
-                    try:
-                        return datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%dT%H:%M:%S.000Z")
-                    except ValueError:
-                        return None
-                return None
+        # Cada tipo de gasto distinto se mapea una sola vez, traduciendo juntos los desconocidos
+        expense_type_ids = expense_mapper.map_expense_types(data_frame["Tipo de gasto"].tolist())
 
-            start_date = convert_date(row["Fecha inicio"])
-            end_date = convert_date(row["Fecha fin"])
+        start_dates = map_distinct(data_frame["Fecha inicio"], self.convert_date)
+        end_dates = map_distinct(data_frame["Fecha fin"], self.convert_date)
+        frequencies = map_distinct(data_frame["Frecuencia del gasto"], expense_mapper.map_frequency)
+        user_ids = [self.user_id_mapping.get(email, None) for email in data_frame["Email"].tolist()]
 
-            user_id = self.user_id_mapping.get(row["Email"], None)
+        tax_percentage = numeric_column(data_frame["Porcentaje impuesto"], self.convert_to_numeric)
+        tax_currency = numeric_column(data_frame["Impuesto monetario"], self.convert_to_numeric)
+        discount_percentage = numeric_column(data_frame["Porcentaje descuento"], self.convert_to_numeric)
+        discount_currency = numeric_column(data_frame["Descuento monetario"], self.convert_to_numeric)
+        subtotal = numeric_column(data_frame["Subtotal"], self.convert_to_numeric)
 
-            tax_percentage = self.convert_to_numeric(row["Porcentaje impuesto"])
-            tax_currency = self.convert_to_numeric(row["Impuesto monetario"])
-            discount_percentage = self.convert_to_numeric(row["Porcentaje descuento"])
-            discount_currency = self.convert_to_numeric(row["Descuento monetario"])
+        # Se prefiere el importe monetario sobre el porcentaje, sin ninguno de los dos queda 0 en CURRENCY
+        tax_is_percentage = ~(tax_currency > 0) & (tax_percentage > 0)
+        tax = np.where(tax_currency > 0, tax_currency, np.where(tax_is_percentage, tax_percentage, 0.0))
+        discount_is_percentage = ~(discount_currency > 0) & (discount_percentage > 0)
+        discount = np.where(
+            discount_currency > 0, discount_currency, np.where(discount_is_percentage, discount_percentage, 0.0)
+        )
+        has_tax = (tax_currency > 0) | tax_is_percentage
+        has_discount = (discount_currency > 0) | discount_is_percentage
+        # Subtotal vacío o 0 queda como el entero 0, igual que "subtotal or 0"
+        subtotal_is_zero = subtotal == 0
+        subtotal = np.where(subtotal_is_zero, 0.0, subtotal)
 
-            if tax_currency > 0:
-                tax = tax_currency
-                tax_type = "CURRENCY"
-            elif tax_percentage > 0:
-                tax = tax_percentage
-                tax_type = "PERCENTAGE"
-            else:
-                tax = 0
-                tax_type = "CURRENCY"
-
-            if discount_currency > 0:
-                discount = discount_currency
-                discount_type = "CURRENCY"
-            elif discount_percentage > 0:
-                discount = discount_percentage
-                discount_type = "PERCENTAGE"
-            else:
-                discount = 0
-                discount_type = "CURRENCY"
-
-            subtotal = self.convert_to_numeric(row["Subtotal"]) or 0
-            client_total = self.calculate_total_expense(tax, tax_type, discount_type, discount, subtotal)
-            frecuencia = expense_mapper.map_frequency(row["Frecuencia del gasto"])
-
-            mapped_row = {
-                "name": row["Nombre del gasto"],
-                "expenseTypeId": expense_mapper.map_expense_type(row["Tipo de gasto"]),
-                "subtotal": subtotal,
-                "taxType": tax_type,
-                "tax": tax,
-                "discountType": discount_type,
-                "discount": discount,
-                "total": client_total,
-                "userId": user_id,
-                "startDate": start_date,
-                "endDate": end_date,
-                "frecuency": frecuencia
-            }
+        client_total = self.calculate_total_expenses(tax, tax_is_percentage, discount, discount_is_percentage, subtotal)
+
+        # Los ceros enteros se conservan como int para que el body enviado sea el mismo
+        taxes = [value if flag else 0 for value, flag in zip(tax.tolist(), has_tax.tolist())]
+        discounts = [value if flag else 0 for value, flag in zip(discount.tolist(), has_discount.tolist())]
+        subtotals = [0 if is_zero else value for value, is_zero in zip(subtotal.tolist(), subtotal_is_zero.tolist())]
+        totals_are_int = subtotal_is_zero & ~has_tax & ~has_discount
+        totals = [0 if is_int else value for value, is_int in zip(client_total.tolist(), totals_are_int.tolist())]
 
-            mapped_rows.append(mapped_row)
+        columns = {
+            "name": data_frame["Nombre del gasto"].tolist(),
+            "expenseTypeId": expense_type_ids,
+            "subtotal": subtotals,
+            "taxType": np.where(tax_is_percentage, "PERCENTAGE", "CURRENCY").tolist(),
+            "tax": taxes,
+            "discountType": np.where(discount_is_percentage, "PERCENTAGE", "CURRENCY").tolist(),
+            "discount": discounts,
+            "total": totals,
+            "userId": user_ids,
+            "startDate": start_dates,
+            "endDate": end_dates,
+            "frecuency": frequencies,
+        }
+        keys = list(columns)
+        return [dict(zip(keys, values)) for values in zip(*columns.values())]
 
-        return mapped_rows
+    @staticmethod
+    def convert_date(date_str):
+        if isinstance(date_str, str) and date_str.strip():
+            try:
+                return datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            except ValueError:
+                return None
+        return None
+
+    @staticmethod
+    def calculate_total_expenses(tax, tax_is_percentage, discount, discount_is_percentage, subtotal):
+        """Versión por columnas de calculate_total_expense, con las mismas operaciones en el mismo orden."""
+        # Importes vacíos o infinitos dan nan como en la versión por fila, sin avisos de numpy
+        with np.errstate(invalid="ignore", over="ignore"):
+            calculated_discount = np.where(discount_is_percentage, (discount / 100) * subtotal, discount)
+            subtotal_after_discount = subtotal - calculated_discount
+            calculated_tax = np.where(tax_is_percentage, (tax / 100) * subtotal_after_discount, tax)
+            return subtotal - calculated_discount + calculated_tax
 
     @staticmethod
     def calculate_total_expense(tax, tax_type, discount_type, discount, subtotal):
@@ -178,7 +264,7 @@ class ExpensesLoader:
             return 0
     
     def load_expenses(self):
-        if not self.validate_token():
+        if not self.token_valid:
             print("Token no válido.")
             return
         
@@ -192,37 +278,90 @@ class ExpensesLoader:
         
         mapped_rows = self.map_rows(data_frame)
         
-        failed_rows = []
-        errors_file = os.path.join(self.errors_dir, f"errors_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx")
-        
-        with tqdm(total=len(mapped_rows), desc="Procesando filas", unit="fila") as pbar:
-            for index, row in enumerate(mapped_rows):
-                try:
-                    self.logger.info(f"Realizando POST a {self.api_url}")
-                    self.logger.info(f"Body enviado: {row}")
-                    
-                    response = requests.post(self.api_url, json=row, headers={'Authorization': f'Bearer {self.token}'})
-                    
-                    if response.status_code == 201:
-                        self.logger.info(f"Respuesta exitosa para la fila {index + 1}: {response.status_code}")
-                    else:
-                        self.logger.error(f"Error al procesar la fila {index + 1}: {response.status_code} - {response.text}")
-                        failed_rows.append(row)
-                except Exception as e:
-                    self.logger.error(f"Error al procesar la fila {index + 1}: {e}")
-                    failed_rows.append(row)
-                pbar.update(1)
-        
-        if failed_rows:
-            error_df = pd.DataFrame(failed_rows)
-            error_df.to_excel(errors_file, index=False)
+        errors_file = os.path.join(self.errors_dir, f"errors_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv")
+        outcomes = self.submit_rows(mapped_rows, errors_file)
+
+        failed = sum(1 for outcome in outcomes if outcome["status"] == "error")
+        self.logger.info(f"Gastos creados: {len(outcomes) - failed}, fallidos: {failed}")
+        if failed:
             print(f"Errores guardados en {errors_file}")
-        
+        else:
+            os.remove(errors_file)
+
         result_file = "processed_expenses.xlsx"
         data_frame.to_excel(result_file, index=False)
     
         print("Carga completa. Fin.")
 
+    def submit_rows(self, mapped_rows: list, errors_file: str, max_in_flight: int = MAX_IN_FLIGHT) -> list:
+        """
+        Envía las filas con hasta max_in_flight peticiones en paralelo. Las filas fallidas se escriben en
+        errors_file (csv) según van terminando, con el número de fila, el estatus, los intentos y el body.
+
+        :return: un resultado por fila, en el orden del archivo, con fila, status ("ok" o "error"),
+            status_code, intentos y error.
+        """
+        outcomes = [None] * len(mapped_rows)
+        body_columns = list(dict.fromkeys(key for row in mapped_rows for key in row))
+        lock = threading.Lock()
+
+        with open(errors_file, "w", newline="", encoding="utf-8") as file, \
+                tqdm(total=len(mapped_rows), desc="Procesando filas", unit="fila") as pbar, \
+                ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            writer = csv.DictWriter(file, ERROR_COLUMNS + body_columns, extrasaction="ignore")
+            writer.writeheader()
+
+            futures = {
+                executor.submit(self.post_row, index + 1, row): index
+                for index, row in enumerate(mapped_rows)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                outcome = future.result()
+                outcomes[index] = outcome
+                if outcome["status"] == "error":
+                    with lock:
+                        writer.writerow({**mapped_rows[index], **outcome})
+                        file.flush()
+                pbar.update(1)
+
+        return outcomes
+
+    def post_row(self, row_number: int, row: dict) -> dict:
+        """Envía una fila reintentando los errores transitorios y devuelve su resultado."""
+        outcome = {"fila": row_number, "status": "error", "status_code": None, "intentos": 0, "error": None}
+
+        for attempt in range(1, MAX_RETRIES + 2):
+            outcome["intentos"] = attempt
+            self.logger.debug(f"Body enviado para la fila {row_number}: {row}")
+            try:
+                response = self.session.post(self.api_url, json=row, timeout=REQUEST_TIMEOUT_SECONDS)
+            except requests.RequestException as e:
+                # Solo se reintenta si no se llegó a abrir la conexión: si se cortó después de enviar el
+                # body el API puede haber creado el gasto y reintentar lo duplicaría
+                outcome["error"] = str(e)
+                retry = is_connect_error(e)
+            else:
+                outcome["status_code"] = response.status_code
+                if response.status_code == 201:
+                    outcome["status"] = "ok"
+                    outcome["error"] = None
+                    self.logger.info(f"Respuesta exitosa para la fila {row_number}: {response.status_code}")
+                    return outcome
+                outcome["error"] = response.text
+                retry = response.status_code in RETRY_STATUS_CODES
+
+            if not retry or attempt > MAX_RETRIES:
+                break
+            wait = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            self.logger.warning(f"Reintentando la fila {row_number} en {wait} s: {outcome['error']}")
+            time.sleep(wait)
+
+        self.logger.error(
+            f"Error al procesar la fila {row_number}: {outcome['status_code']} - {outcome['error']}"
+        )
+        return outcome
+
     def log_failed_row(self, row, error_message):
         log_entry = {
             "row": row,
@@ -231,4 +370,35 @@ class ExpensesLoader:
         }
         with open(os.path.join(self.errors_dir, "failed_rows.log"), "a") as log_file:
             log_file.write(f"{log_entry}\n")
-        self.logger.error(f"Fila fallida registrada: {log_entry}")
\ No newline at end of file
+        self.logger.error(f"Fila fallida registrada: {log_entry}")
+
+
+def is_connect_error(error: Exception) -> bool:
+    """True si la petición falló antes de salir del cliente (timeout o error al abrir la conexión)."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    # NewConnectionError y NameResolutionError heredan de ConnectTimeoutError
+    return isinstance(reason, ConnectTimeoutError)
+
+
+def map_distinct(series: pd.Series, func) -> list:
+    """Aplica func una sola vez por valor distinto de la columna y devuelve la lista de resultados."""
+    results = {}
+    mapped = []
+    for value in series.tolist():
+        try:
+            mapped.append(results[value])
+        except KeyError:
+            results[value] = func(value)
+            mapped.append(results[value])
+        except TypeError:
+            # Valores que no se pueden usar como clave
+            mapped.append(func(value))
+    return mapped
+
+
+def numeric_column(series: pd.Series, convert) -> np.ndarray:
+    return np.array(map_distinct(series, convert), dtype=float)
@@ -0,0 +1,113 @@
+"""
+Tablas de búsqueda de vehículos y proveedores a partir de un snapshot SQLite.
+
+El snapshot se genera con las exportaciones en CSV de las queries del README:
+
+    python3 lookups.py --vehicles vehiculos.csv --suppliers proveedores.csv
+
+Si no existe el snapshot se usan las enumeraciones de vehicles_enum.py y suppliers_enum.py.
+"""
+import argparse
+import csv
+import os
+import re
+import sqlite3
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lookups.sqlite")
+TABLES = ["vehicles", "suppliers"]
+
+def clean_vehicle_name(name):
+    """Elimina caracteres especiales de las matrículas dejando solo alfanuméricos."""
+    return re.sub(r'\W+', '', name)
+
+def capitalize_supplier_name(supplier):
+    """Formatea el nombre del proveedor."""
+    return supplier.capitalize()
+
+NORMALIZERS = {"vehicles": clean_vehicle_name, "suppliers": capitalize_supplier_name}
+
+class SnapshotLookup:
+    """
+    Búsqueda por clave normalizada en una tabla del snapshot. Cada consulta usa la clave primaria de
+    SQLite y el resultado se guarda en memoria, así no hace falta cargar toda la tabla al importar.
+    """
+
+    def __init__(self, connection, table):
+        self.connection = connection
+        self.table = table
+        self.normalize = NORMALIZERS[table]
+        self._cache = {}
+
+    def get(self, key, default=None):
+        key = self.normalize(key)
+        if key not in self._cache:
+            row = self.connection.execute(f"SELECT id FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            self._cache[key] = row[0] if row else None
+        value = self._cache[key]
+        return default if value is None else value
+
+class EnumLookup:
+    """Misma interfaz que SnapshotLookup sobre una enumeración, con las claves normalizadas."""
+
+    def __init__(self, values, table):
+        self.normalize = NORMALIZERS[table]
+        self.values = {}
+        for key, value in values.items():
+            self.values.setdefault(self.normalize(key), value)
+
+    def get(self, key, default=None):
+        return self.values.get(self.normalize(key), default)
+
+def load_lookups(snapshot_path=SNAPSHOT_PATH):
+    """
+    :return: (proveedores, vehículos) con un método get(nombre). Se leen del snapshot si existe y si no
+        de las enumeraciones.
+    """
+    if snapshot_path and os.path.exists(snapshot_path):
+        connection = sqlite3.connect(snapshot_path, check_same_thread=False)
+        return SnapshotLookup(connection, "suppliers"), SnapshotLookup(connection, "vehicles")
+
+    from suppliers_enum import SUPPLIERS
+    from vehicles_enum import VEHICLES
+    return EnumLookup(SUPPLIERS, "suppliers"), EnumLookup(VEHICLES, "vehicles")
+
+def read_export(file_path, key_column):
+    """Lee un CSV exportado de la base de datos y devuelve pares (clave, id)."""
+    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            if row.get(key_column) and row.get("id"):
+                yield row[key_column], int(row["id"])
+
+def build_snapshot(snapshot_path=SNAPSHOT_PATH, vehicles_file=None, suppliers_file=None):
+    """
+    Crea o actualiza el snapshot. vehicles_file debe tener las columnas registration_number_v2 e id y
+    suppliers_file las columnas id y name. Si una clave normalizada se repite se conserva la primera.
+    """
+    sources = {
+        "vehicles": (vehicles_file, "registration_number_v2"),
+        "suppliers": (suppliers_file, "name"),
+    }
+    with sqlite3.connect(snapshot_path) as connection:
+        for table in TABLES:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, id INTEGER NOT NULL) WITHOUT ROWID")
+        for table, (file_path, key_column) in sources.items():
+            if not file_path:
+                continue
+            normalize = NORMALIZERS[table]
+            connection.execute(f"DELETE FROM {table}")
+            connection.executemany(
+                f"INSERT OR IGNORE INTO {table} (key, id) VALUES (?, ?)",
+                ((normalize(key), value) for key, value in read_export(file_path, key_column)),
+            )
+            total = connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            print(f"{table}: {total} registros en {snapshot_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera el snapshot de vehículos y proveedores.")
+    parser.add_argument("--vehicles", help="CSV con registration_number_v2 e id.")
+    parser.add_argument("--suppliers", help="CSV con id y name.")
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH, help="Ruta del snapshot SQLite.")
+    args = parser.parse_args()
+    if not args.vehicles and not args.suppliers:
+        parser.error("Indica al menos --vehicles o --suppliers.")
+    build_snapshot(args.snapshot, args.vehicles, args.suppliers)
@@ -1,16 +1,16 @@
+import argparse
 import csv
-import re
+import os
 
-from suppliers_enum import SUPPLIERS
-from vehicles_enum import VEHICLES
+from lookups import SNAPSHOT_PATH, capitalize_supplier_name, clean_vehicle_name, load_lookups
 
-def clean_vehicle_name(name):
-    """Elimina caracteres especiales de las matrículas dejando solo alfanuméricos."""
-    return re.sub(r'\W+', '', name)
+# Filas por sentencia UPDATE ... FROM (VALUES ...) en el modo batched
+DEFAULT_CHUNK_SIZE = 1000
+OUTPUT_MODES = ["statements", "batched", "copy"]
 
-def capitalize_supplier_name(supplier):
-    """Formatea el nombre del proveedor."""
-    return supplier.capitalize()
+def sql_literal(value):
+    """Literal de texto SQL con las comillas simples escapadas."""
+    return "'" + str(value).replace("'", "''") + "'"
 
 def load_rl_enum(file_path):
     rl_enum = {}
@@ -23,39 +23,140 @@ def load_rl_enum(file_path):
             rl_enum[expense_name] = {"vehicle_name": vehicle_name, "supplier": supplier}
     return rl_enum
 
-def generate_updates(account_id, rl_enum_file, output_file):
+def resolve_updates(rl_enum_file, snapshot_path=SNAPSHOT_PATH):
+    """
+    Busca el vehicle_id y supplier_id de cada gasto del CSV en el snapshot, o en las enumeraciones si
+    no existe.
+
+    :return: lista de (expense_name, vehicle_id, supplier_id) de los gastos con ambos ids, los que no
+        los tienen se avisan por pantalla.
+    """
     rl_enum = load_rl_enum(rl_enum_file)
+    suppliers, vehicles = load_lookups(snapshot_path)
+    resolved = []
+    for expense_name, details in rl_enum.items():
+        vehicle_name = details["vehicle_name"]
+        supplier = details["supplier"]
+
+        supplier_id = suppliers.get(supplier)
+        vehicle_id = vehicles.get(vehicle_name)
+
+        if supplier_id and vehicle_id:
+            resolved.append((expense_name, vehicle_id, supplier_id))
+        else:
+            # Registrar problemas si faltan IDs.
+            if not supplier_id:
+                print(f"WARNING: No supplier_id found for supplier '{supplier}'.")
+            if not vehicle_id:
+                print(f"WARNING: No vehicle_id found for vehicle '{vehicle_name}'.")
+    return resolved
+
+def generate_updates(account_id, rl_enum_file, output_file, snapshot_path=SNAPSHOT_PATH):
+    """Una sentencia UPDATE por gasto."""
     updates = []
     with open(output_file, mode='w') as file:
-        for expense_name, details in rl_enum.items():
-            vehicle_name = details["vehicle_name"]
-            supplier = details["supplier"]
-            
-            supplier_id = SUPPLIERS.get(supplier)
-            vehicle_id = VEHICLES.get(vehicle_name)
-
-            if supplier_id and vehicle_id:
-                query = f"""UPDATE public.scheduled_expenses
-SET 
-    vehicle_id = {vehicle_id}, 
+        for expense_name, vehicle_id, supplier_id in resolve_updates(rl_enum_file, snapshot_path):
+            query = f"""UPDATE public.scheduled_expenses
+SET
+    vehicle_id = {vehicle_id},
     supplier_id = {supplier_id}
-WHERE "name"='{expense_name}' 
+WHERE "name"={sql_literal(expense_name)}
 AND account_id = {account_id};
 """
-                updates.append(query)
-                file.write(query + "\n")
-            else:
-                # Registrar problemas si faltan IDs.
-                if not supplier_id:
-                    print(f"WARNING: No supplier_id found for supplier '{supplier}'.")
-                if not vehicle_id:
-                    print(f"WARNING: No vehicle_id found for vehicle '{vehicle_name}'.")
+            updates.append(query)
+            file.write(query + "\n")
+    return updates
+
+def generate_batched_updates(account_id, rl_enum_file, output_file, chunk_size=DEFAULT_CHUNK_SIZE, snapshot_path=SNAPSHOT_PATH):
+    """
+    Una sentencia UPDATE ... FROM (VALUES ...) por cada chunk_size gastos, así la base de datos resuelve
+    cada bloque con un solo join en lugar de una búsqueda por gasto.
+    """
+    resolved = resolve_updates(rl_enum_file, snapshot_path)
+    updates = []
+    with open(output_file, mode='w') as file:
+        for start in range(0, len(resolved), chunk_size):
+            values = ",\n".join(
+                f"    ({sql_literal(expense_name)}, {vehicle_id}, {supplier_id})"
+                for expense_name, vehicle_id, supplier_id in resolved[start:start + chunk_size]
+            )
+            query = f"""UPDATE public.scheduled_expenses se
+SET
+    vehicle_id = v.vehicle_id,
+    supplier_id = v.supplier_id
+FROM (VALUES
+{values}
+) AS v("name", vehicle_id, supplier_id)
+WHERE se."name" = v."name"
+AND se.account_id = {account_id};
+"""
+            updates.append(query)
+            file.write(query + "\n")
     return updates
 
+def generate_copy_update(account_id, rl_enum_file, output_file, csv_file=None, snapshot_path=SNAPSHOT_PATH):
+    """
+    Guarda los ids en un CSV y en output_file un script de psql que lo carga con \\copy en una tabla
+    temporal y actualiza todos los gastos con un único UPDATE.
+    """
+    csv_file = csv_file or f"{os.path.splitext(output_file)[0]}.csv"
+    resolved = resolve_updates(rl_enum_file, snapshot_path)
+    with open(csv_file, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["name", "vehicle_id", "supplier_id"])
+        writer.writerows(resolved)
+
+    # \copy lee el archivo desde la máquina donde corre psql, relativo a donde se ejecute
+    query = f"""BEGIN;
+
+CREATE TEMP TABLE scheduled_expenses_updates (
+    "name" text PRIMARY KEY,
+    vehicle_id bigint NOT NULL,
+    supplier_id bigint NOT NULL
+) ON COMMIT DROP;
+
+\\copy scheduled_expenses_updates ("name", vehicle_id, supplier_id) FROM {sql_literal(os.path.basename(csv_file))} WITH (FORMAT csv, HEADER true)
+
+UPDATE public.scheduled_expenses se
+SET
+    vehicle_id = u.vehicle_id,
+    supplier_id = u.supplier_id
+FROM scheduled_expenses_updates u
+WHERE se."name" = u."name"
+AND se.account_id = {account_id};
+
+COMMIT;
+"""
+    with open(output_file, mode='w') as file:
+        file.write(query)
+    print(f"{len(resolved)} gastos guardados en {csv_file}")
+    return [query]
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Genera el SQL para actualizar el proveedor y el vehículo de los gastos programados."
+    )
+    parser.add_argument("--account-id", type=int, default=1, help="El de la cuenta.")
+    parser.add_argument("--input", default="expenses_file_example.csv", help="Ruta del archivo CSV.")
+    parser.add_argument("--output", default="renting_leasing_query_update.txt", help="Ruta del archivo de salida.")
+    parser.add_argument(
+        "--mode",
+        choices=OUTPUT_MODES,
+        default="statements",
+        help="statements: un UPDATE por gasto; batched: UPDATE ... FROM (VALUES ...) por bloques; "
+             "copy: CSV para \\copy y un único UPDATE.",
+    )
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH, help="Snapshot SQLite generado con lookups.py.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Gastos por UPDATE en modo batched.")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    account_id = 1 # El de la cuenta.
-    rl_enum_file = 'expenses_file_example.csv'  # Ruta del archivo CSV.
-    output_file = 'renting_leasing_query_update.txt'  # Ruta del archivo de salida.
-    queries = generate_updates(account_id, rl_enum_file, output_file)
+    args = parse_args()
+    if args.mode == "batched":
+        queries = generate_batched_updates(args.account_id, args.input, args.output, args.chunk_size, args.snapshot)
+    elif args.mode == "copy":
+        queries = generate_copy_update(args.account_id, args.input, args.output, snapshot_path=args.snapshot)
+    else:
+        queries = generate_updates(args.account_id, args.input, args.output, args.snapshot)
     for query in queries:
         print(query)
@@ -1,9 +1,52 @@
+import json
+import os
 import pandas as pd
 from datetime import datetime
-from deep_translator import GoogleTranslator
+
+# Traducciones ya resueltas, se reutilizan entre ejecuciones
+TRANSLATION_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "translation_cache.json")
+
+# Sinónimos y traducciones habituales de los tipos de gasto, se consultan antes de traducir
+EXPENSE_TYPE_SYNONYMS = {
+    "bonuses": "bonificaciones",
+    "bonus": "bonificaciones",
+    "gas cylinders": "bombonas",
+    "purchase": "compra",
+    "donations": "donativos",
+    "washing": "lavado/limpieza",
+    "cleaning": "lavado/limpieza",
+    "car wash": "lavado/limpieza",
+    "lavado": "lavado/limpieza",
+    "limpieza": "lavado/limpieza",
+    "lubricants": "lubricantes",
+    "fines": "multas",
+    "electric charging occupancy": "ocupación recarga eléctrica",
+    "others": "otros",
+    "other": "otros",
+    "tolls": "peajes",
+    "toll": "peajes",
+    "penalties": "penalizaciones",
+    "recharges": "recargas",
+    "top-ups": "recargas",
+    "workshop": "taller",
+    "shop": "tienda",
+    "store": "tienda",
+    "vehicle procedures": "trámites del vehículo",
+    "tramites del vehiculo": "trámites del vehículo",
+    "vehicle inspection": "itv",
+    "mot": "itv",
+    "electric charging": "recarga eléctrica",
+    "ev charging": "recarga eléctrica",
+    "recarga electrica": "recarga eléctrica",
+}
 
 class ExpenseMapper:
-    def __init__(self):
+    def __init__(self, translator=None, cache_path=TRANSLATION_CACHE_PATH):
+        """
+        :param translator: objeto con translate_batch(lista) o translate(valor), por defecto GoogleTranslator
+            de inglés a español. Permite usar un traductor de prueba sin conexión.
+        :param cache_path: json con las traducciones ya resueltas, None para no guardarlas en disco.
+        """
         self.expense_type_map = {
             "bonificaciones": 74079,
             "bombonas": 74080,
@@ -37,26 +80,101 @@ class ExpenseMapper:
             "semana": "week",
             "semanal": "week"
         }
-        self.translator = GoogleTranslator(source="en", target="es")
+        self.synonyms = dict(EXPENSE_TYPE_SYNONYMS)
+        self._translator = translator
+        self.cache_path = cache_path
+        self.translation_cache = self.load_translation_cache()
+        # Valores que no se pudieron traducir en esta ejecución, no se guardan en disco para reintentarlos
+        self.failed_translations = set()
 
-    def translate_to_spanish(self, value):
+    @property
+    def translator(self):
+        # deep_translator solo se importa si hace falta traducir
+        if self._translator is None:
+            from deep_translator import GoogleTranslator
+            self._translator = GoogleTranslator(source="en", target="es")
+        return self._translator
+
+    def load_translation_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
         try:
-            return self.translator.translate(value)
-        except Exception as e:
-            print(f"Error al traducir: {e}")
-            return value
+            with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError) as e:
+            print(f"No se pudo leer la caché de traducciones {self.cache_path}: {e}")
+            return {}
 
-    def map_expense_type(self, value):
-        if isinstance(value, str):
-            value = value.strip().lower()
-        else:
-            value = str(value).strip().lower()
+    def save_translation_cache(self):
+        if not self.cache_path:
+            return
+        temporary_path = f"{self.cache_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as cache_file:
+            json.dump(self.translation_cache, cache_file, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.cache_path)
+
+    def translate_to_spanish(self, value):
+        return self.translate_batch([value]).get(value, value)
+
+    def translate_batch(self, values):
+        """
+        Traduce los valores que no estén en caché con una sola llamada al traductor y guarda el resultado.
+        Las traducciones que no corresponden a ningún tipo de gasto también se guardan (caché negativa).
+
+        :return: diccionario {valor: traducción}, sin los valores que no se pudieron traducir.
+        """
+        pending = [
+            value for value in dict.fromkeys(values)
+            if value not in self.translation_cache and value not in self.failed_translations
+        ]
+        if pending:
+            try:
+                if hasattr(self.translator, "translate_batch"):
+                    translations = self.translator.translate_batch(pending)
+                else:
+                    translations = [self.translator.translate(value) for value in pending]
+            except Exception as e:
+                print(f"Error al traducir: {e}")
+                self.failed_translations.update(pending)
+            else:
+                for value, translation in zip(pending, translations):
+                    self.translation_cache[value] = (translation or "").strip().lower()
+                self.save_translation_cache()
+        return {value: self.translation_cache[value] for value in values if value in self.translation_cache}
+
+    def lookup_expense_type(self, value):
+        """Busca el tipo de gasto en el mapa y en los sinónimos, sin traducir."""
         mapped_id = self.expense_type_map.get(value)
         if mapped_id:
             return mapped_id
+        return self.expense_type_map.get(self.synonyms.get(value))
+
+    def map_expense_types(self, values):
+        """
+        Mapea una lista de tipos de gasto. Cada valor distinto se resuelve una sola vez y los que no
+        están en el mapa ni en los sinónimos se traducen juntos en una única llamada.
+        """
+        normalized = [
+            value.strip().lower() if isinstance(value, str) else str(value).strip().lower()
+            for value in values
+        ]
+        resolved = {}
+        to_translate = []
+        for value in dict.fromkeys(normalized):
+            resolved[value] = self.lookup_expense_type(value)
+            if resolved[value] is None:
+                to_translate.append(value)
 
-        value_in_spanish = self.translate_to_spanish(value)
-        return self.expense_type_map.get(value_in_spanish, None)
+        if to_translate:
+            translations = self.translate_batch(to_translate)
+            for value in to_translate:
+                if value in translations:
+                    resolved[value] = self.lookup_expense_type(translations[value])
+
+        return [resolved[value] for value in normalized]
+
+    def map_expense_type(self, value):
+        return self.map_expense_types([value])[0]
 
 
     def map_frequency(self, value):
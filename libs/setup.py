@@ -9,7 +9,8 @@ setup(
         "requests",
         "python-dotenv",
         "pandas",
-        "pytz"
+        "pytz",
+        "openpyxl"
     ],
     author="Pulpomatic",
     description="Librería común para los scripts de Pulpomatic",
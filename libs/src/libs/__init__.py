@@ -1,4 +1,28 @@
 from .logger import setup_logger
 from .pulpo_api import *
+from .result_writer import ResultWriter
+from .rate_limiter import RateLimiter
+from .stage_timer import StageTimer
+from .s3_listing import (
+    date_prefixes,
+    date_subfolder_prefixes,
+    find_matching_files,
+    iter_matching_files,
+    list_prefixes,
+    list_objects,
+    list_objects_parallel,
+)
 
-__all__ = ['setup_logger']
\ No newline at end of file
+__all__ = [
+    'setup_logger',
+    'ResultWriter',
+    'RateLimiter',
+    'StageTimer',
+    'date_prefixes',
+    'date_subfolder_prefixes',
+    'find_matching_files',
+    'iter_matching_files',
+    'list_prefixes',
+    'list_objects',
+    'list_objects_parallel',
+]
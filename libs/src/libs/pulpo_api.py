@@ -1,4 +1,5 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
@@ -148,3 +149,56 @@ class PulpoApi:
             }
             for supplier in suppliers
         ]
+
+    def get_all_fuels(self, q: dict = None, page_size: int = 500, max_workers: int = 5):
+        """
+        Retorna todos los combustibles de la cuenta que cumplan el filtro q, sin ser mapeados.
+        """
+        return self.get_all_pages("fuels", "fuels", q, page_size, max_workers)
+
+    def get_all_expenses(
+        self, q: dict = None, page_size: int = 500, max_workers: int = 5
+    ):
+        """
+        Retorna todos los gastos de la cuenta que cumplan el filtro q, sin ser mapeados.
+        """
+        return self.get_all_pages("expenses", "expenses", q, page_size, max_workers)
+
+    def get_all_pages(
+        self,
+        path: str,
+        list_key: str,
+        q: dict = None,
+        page_size: int = 500,
+        max_workers: int = 5,
+    ):
+        """
+        Descarga un listado completo por páginas de page_size filas. La primera página indica el total
+        de filas (_metadata._total_rows) y el resto se piden en paralelo con max_workers peticiones.
+        """
+        first_page, total_rows = self._get_page(path, list_key, q, 0, page_size)
+        skips = range(page_size, total_rows, page_size)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pages = executor.map(
+                lambda skip: self._get_page(path, list_key, q, skip, page_size)[0],
+                skips,
+            )
+            return first_page + [item for page in pages for item in page]
+
+    def _get_page(self, path: str, list_key: str, q: dict, skip: int, take: int):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        params = {"skip": skip, "take": take}
+        if q is not None:
+            params["q"] = json.dumps(q)
+
+        response = requests.get(
+            f"{self.base_url}/{path}", headers=headers, params=params
+        )
+        if response.status_code != 200:
+            raise ValueError(
+                f"Error al obtener {path}, el estatus devuelto {response.status_code}"
+            )
+        response_json = response.json()
+        items = response_json.get(list_key, response_json.get("list", []))
+        total_rows = response_json.get("_metadata", {}).get("_total_rows", len(items))
+        return items, total_rows
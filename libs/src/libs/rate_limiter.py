@@ -0,0 +1,37 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Limita el ritmo de llamadas a un número máximo por segundo, compartido entre todos los hilos que usan
+    la misma instancia. Las llamadas se espacian de forma uniforme en lugar de dormir un tiempo fijo.
+
+    Uso:
+        limiter = RateLimiter(2.5)
+        limiter.acquire()  # bloquea hasta que toque el siguiente turno
+        requests.post(...)
+    """
+
+    def __init__(self, requests_per_second: float = None):
+        """
+        :param requests_per_second: llamadas por segundo permitidas, None o 0 para no limitar
+        """
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+        self.interval = 0
+        self.set_rate(requests_per_second)
+
+    def set_rate(self, requests_per_second: float = None):
+        with self._lock:
+            self.interval = 1 / requests_per_second if requests_per_second else 0
+
+    def acquire(self):
+        with self._lock:
+            if self.interval == 0:
+                return
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,159 @@
+import csv
+import json
+import logging
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+SUPPORTED_FORMATS = ("csv", "jsonl", "xlsx")
+
+logger = logging.getLogger("process_logger")
+
+
+class ResultWriter:
+    """
+    Escribe filas de resultados (procesados o errores) de forma incremental a medida que llegan,
+    sin construir un DataFrame con todas las filas en memoria.
+
+    - csv y jsonl se escriben y se vacían a disco fila a fila, por lo que un resultado parcial
+      sobrevive aunque el script se detenga a mitad de la carga.
+    - xlsx usa el modo write_only de openpyxl (memoria constante), pero el archivo solo queda
+      completo al cerrar el writer, por eso se recomienda combinarlo con csv o jsonl.
+
+    Los archivos se crean con la primera fila escrita, si no se escribe ninguna fila no se crea nada.
+
+    Uso:
+        with ResultWriter("processed/archivo_combustibles", ["csv", "xlsx"]) as writer:
+            writer.write({"MATRICULA": "1234ABC", "error": None})
+    """
+
+    def __init__(self, base_path: str, formats=("csv",), columns: list = None):
+        """
+        :param base_path: ruta del archivo sin extensión, se añade la extensión de cada formato
+        :param formats: formatos a generar, cualquiera de csv, jsonl y xlsx
+        :param columns: columnas y orden de salida, si no se indican se toman de la primera fila
+        """
+        unknown_formats = set(formats) - set(SUPPORTED_FORMATS)
+        if unknown_formats:
+            raise ValueError(f"Formatos no soportados: {', '.join(unknown_formats)}")
+
+        self.base_path = base_path
+        self.formats = list(dict.fromkeys(formats))
+        self.columns = list(columns) if columns is not None else None
+        self.count = 0
+        self._csv_file = None
+        self._csv_writer = None
+        self._jsonl_file = None
+        self._workbook = None
+        self._worksheet = None
+        self._warned_extra_columns = False
+
+    @property
+    def paths(self) -> list:
+        """Rutas de los archivos generados, vacía si no se escribió ninguna fila."""
+        if self.count == 0:
+            return []
+        return [f"{self.base_path}.{file_format}" for file_format in self.formats]
+
+    def write(self, row: dict):
+        if self.count == 0:
+            self._open(row)
+
+        extra_columns = [key for key in row if key not in self.columns]
+        if extra_columns and not self._warned_extra_columns:
+            self._warned_extra_columns = True
+            logger.warning(
+                f"Columnas {extra_columns} no definidas en {self.base_path}, solo se guardarán en jsonl"
+            )
+
+        values = [to_cell_value(row.get(column)) for column in self.columns]
+        if self._csv_writer is not None:
+            self._csv_writer.writerow(values)
+            self._csv_file.flush()
+        if self._jsonl_file is not None:
+            json_row = {
+                key: value if isinstance(value, (dict, list)) else to_cell_value(value)
+                for key, value in row.items()
+            }
+            self._jsonl_file.write(
+                json.dumps(json_row, ensure_ascii=False, default=str)
+            )
+            self._jsonl_file.write("\n")
+            self._jsonl_file.flush()
+        if self._worksheet is not None:
+            self._worksheet.append(values)
+        self.count += 1
+
+    def write_many(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def close(self):
+        if self._csv_file is not None:
+            self._csv_file.close()
+            self._csv_file = None
+            self._csv_writer = None
+        if self._jsonl_file is not None:
+            self._jsonl_file.close()
+            self._jsonl_file = None
+        if self._workbook is not None:
+            self._workbook.save(f"{self.base_path}.xlsx")
+            self._workbook = None
+            self._worksheet = None
+
+    def _open(self, first_row: dict):
+        if self.columns is None:
+            self.columns = list(first_row.keys())
+
+        directory = os.path.dirname(self.base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if "csv" in self.formats:
+            self._csv_file = open(
+                f"{self.base_path}.csv", "w", newline="", encoding="utf-8"
+            )
+            self._csv_writer = csv.writer(self._csv_file)
+            self._csv_writer.writerow(self.columns)
+        if "jsonl" in self.formats:
+            self._jsonl_file = open(f"{self.base_path}.jsonl", "w", encoding="utf-8")
+        if "xlsx" in self.formats:
+            from openpyxl import Workbook
+
+            self._workbook = Workbook(write_only=True)
+            self._worksheet = self._workbook.create_sheet()
+            self._worksheet.append(self.columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def to_cell_value(value):
+    """
+    Convierte un valor a algo que se pueda escribir en una celda de csv o xlsx.
+    Diccionarios y listas se serializan a JSON, los nulos (None, NaN, NaT) quedan vacíos.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    try:
+        if value != value:  # NaN y NaT
+            return None
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        # Excel no soporta fechas con zona horaria
+        return value.isoformat()
+    if isinstance(value, (str, bool, int, float, Decimal, datetime, date)):
+        return value
+    if hasattr(value, "item"):
+        # Escalares de numpy y pandas
+        try:
+            return to_cell_value(value.item())
+        except (ValueError, TypeError):
+            pass
+    return str(value)
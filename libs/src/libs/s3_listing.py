@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Iterable, Iterator, Pattern
+
+
+def list_prefixes(client, bucket: str, prefix: str) -> Iterator[str]:
+    """
+    Devuelve las "carpetas" directamente bajo prefix, recorriendo todas las páginas de list_objects_v2
+    (cada página trae como máximo 1000 resultados).
+    """
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        for common_prefix in page.get("CommonPrefixes", []):
+            yield common_prefix["Prefix"]
+
+
+def date_prefixes(
+    base_prefix: str, start_date: date, end_date: date, date_format: str = "%d-%m-%Y"
+) -> list:
+    """
+    Genera los prefijos de las carpetas por fecha del rango, ambos días incluidos, sin listar el bucket.
+    Por ejemplo Repsol/processed/01-03-2024/, Repsol/processed/02-03-2024/, ...
+    """
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime):
+        end_date = end_date.date()
+    return [
+        f"{base_prefix}{(start_date + timedelta(days=offset)).strftime(date_format)}/"
+        for offset in range((end_date - start_date).days + 1)
+    ]
+
+
+def list_objects(client, bucket: str, prefix: str, suffix: str = None) -> Iterator[dict]:
+    """
+    Devuelve los objetos bajo prefix, de todas las páginas, con Key, Size y ETag.
+
+    :param suffix: si se indica, solo los objetos cuya clave termina en él (por ejemplo ".csv")
+    """
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for content in page.get("Contents", []):
+            if suffix and not content["Key"].endswith(suffix):
+                continue
+            yield {"Key": content["Key"], "Size": content["Size"], "ETag": content.get("ETag")}
+
+
+def list_objects_parallel(
+    client, bucket: str, prefixes: Iterable[str], suffix: str = None, max_workers: int = 8
+) -> Iterator[tuple]:
+    """
+    Lista varios prefijos a la vez en un pool de hilos (los clientes de boto3 se pueden compartir entre
+    hilos) y devuelve (prefijo, objetos) según termina cada uno, sin esperar al resto.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(lambda p: list(list_objects(client, bucket, p, suffix)), prefix): prefix
+            for prefix in prefixes
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def date_subfolder_prefixes(
+    client,
+    bucket: str,
+    prefix: str,
+    subfolders: Iterable[str],
+    start_date: date,
+    end_date: date,
+    discover: bool = False,
+    date_format: str = "%d-%m-%Y",
+) -> list:
+    """
+    Prefijos de las subcarpetas de cada fecha del rango (prefix/fecha/subcarpeta/), en orden cronológico.
+
+    :param discover: False genera las carpetas de fecha sin listar el bucket, así el coste depende del rango
+        y no de todo el histórico. True lista las carpetas bajo prefix y se queda con las que son una fecha
+        del rango, por si alguna no sigue exactamente date_format.
+    """
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime):
+        end_date = end_date.date()
+
+    if discover:
+        dated_folders = []
+        for folder in list_prefixes(client, bucket, prefix):
+            try:
+                folder_date = datetime.strptime(folder[len(prefix):].strip("/"), date_format).date()
+            except ValueError:
+                continue
+            if start_date <= folder_date <= end_date:
+                dated_folders.append((folder_date, folder))
+        folders = [folder for _, folder in sorted(dated_folders)]
+    else:
+        folders = date_prefixes(prefix, start_date, end_date, date_format)
+    return [f"{folder}{subfolder}/" for folder in folders for subfolder in subfolders]
+
+
+def iter_matching_files(
+    client, bucket: str, subfolder_prefixes: Iterable[str], pattern: Pattern, suffix: str = ".csv", max_workers: int = 8
+) -> Iterator[tuple]:
+    """
+    Devuelve (subcarpeta, objeto) de los objetos cuya clave coincide con pattern según se van listando,
+    con las subcarpetas listadas en paralelo.
+    """
+    for subfolder_prefix, objects in list_objects_parallel(
+        client, bucket, subfolder_prefixes, suffix=suffix, max_workers=max_workers
+    ):
+        for obj in objects:
+            if pattern.search(obj["Key"]):
+                yield subfolder_prefix, obj
+
+
+def find_matching_files(
+    client,
+    bucket: str,
+    prefix: str,
+    pattern: Pattern,
+    subfolders: Iterable[str],
+    start_date: date,
+    end_date: date,
+    discover: bool = False,
+    suffix: str = ".csv",
+    max_workers: int = 8,
+) -> list:
+    """
+    Objetos (Key, Size y ETag) de las subcarpetas de las fechas del rango cuya clave coincide con pattern.
+
+    Se ordenan por fecha (cronológico en los dos modos de date_subfolder_prefixes), después por subcarpeta
+    en el orden de subfolders y dentro de cada una por clave.
+    """
+    subfolder_prefixes = date_subfolder_prefixes(
+        client, bucket, prefix, subfolders, start_date, end_date, discover
+    )
+    position = {subfolder_prefix: index for index, subfolder_prefix in enumerate(subfolder_prefixes)}
+    found = iter_matching_files(client, bucket, subfolder_prefixes, pattern, suffix, max_workers)
+    return [obj for _, obj in sorted(found, key=lambda item: (position[item[0]], item[1]["Key"]))]
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class StageTimer:
+    """
+    Mide el tiempo de pared, el tiempo de CPU, la memoria pico (RSS) y las filas por segundo de cada etapa
+    de un script, para saber dónde se va el tiempo de una ejecución.
+
+    Uso:
+        timer = StageTimer()
+        with timer.stage("mapeo", "archivo.xls") as stage:
+            ...
+            stage["rows"] = 1000
+        timer.log_summary(logger)
+        timer.save_json("reports/tiempos.json")
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str, file_name: str = None, rows: int = None):
+        """
+        Mide una etapa, las filas se pueden indicar al abrirla o asignar después en el diccionario devuelto.
+        El tiempo de CPU es el de todo el proceso, incluyendo los hilos que trabajen durante la etapa.
+        """
+        record = {"stage": name, "file": file_name, "rows": rows}
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall_start
+            record["cpu_seconds"] = time.process_time() - cpu_start
+            record["peak_rss_mb"] = peak_rss_mb()
+            record["rows_per_second"] = rows_per_second(
+                record["rows"], record["wall_seconds"]
+            )
+            self.stages.append(record)
+
+    def summary(self) -> dict:
+        by_file = self._aggregate("file", sum_rows=False)
+        total = self._aggregate(None, sum_rows=False).get("total")
+        if total is not None:
+            # Las filas de un archivo pasan por todas sus etapas, el total son las filas de todos los archivos
+            total["rows"] = sum(
+                group["rows"] for file_name, group in by_file.items() if file_name != "-"
+            )
+            total["rows_per_second"] = rows_per_second(total["rows"], total["wall_seconds"])
+        return {
+            "stages": self.stages,
+            "by_stage": self._aggregate("stage", sum_rows=True),
+            "by_file": by_file,
+            "total": total,
+        }
+
+    def format_table(self) -> str:
+        headers = ["Etapa", "Archivo", "Filas", "Tiempo (s)", "CPU (s)", "RSS pico (MB)", "Filas/s"]
+        rows = [
+            [
+                record["stage"],
+                record["file"] or "-",
+                "-" if record["rows"] is None else str(record["rows"]),
+                f"{record['wall_seconds']:.2f}",
+                f"{record['cpu_seconds']:.2f}",
+                "-" if record["peak_rss_mb"] is None else f"{record['peak_rss_mb']:.1f}",
+                "-" if record["rows_per_second"] is None else f"{record['rows_per_second']:.1f}",
+            ]
+            for record in self.stages
+        ]
+        widths = [
+            max(len(row[idx]) for row in [headers] + rows) for idx in range(len(headers))
+        ]
+        lines = [
+            " | ".join(value.ljust(width) for value, width in zip(row, widths))
+            for row in [headers] + rows
+        ]
+        lines.insert(1, "-+-".join("-" * width for width in widths))
+        return "\n".join(lines)
+
+    def log_summary(self, logger: logging.Logger):
+        if len(self.stages) == 0:
+            return
+        logger.info("Resumen de tiempos por etapa:")
+        for line in self.format_table().splitlines():
+            logger.info(line)
+        total = self.summary()["total"]
+        logger.info(
+            f"Tiempo total {total['wall_seconds']:.2f} s, CPU {total['cpu_seconds']:.2f} s"
+        )
+
+    def save_json(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as json_file:
+            json.dump(self.summary(), json_file, ensure_ascii=False, indent=2)
+
+    def _aggregate(self, key: str, sum_rows: bool) -> dict:
+        aggregated = {}
+        for record in self.stages:
+            group = aggregated.setdefault(
+                "total" if key is None else record[key] or "-",
+                {"wall_seconds": 0.0, "cpu_seconds": 0.0, "rows": 0, "peak_rss_mb": None},
+            )
+            group["wall_seconds"] += record["wall_seconds"]
+            group["cpu_seconds"] += record["cpu_seconds"]
+            if sum_rows:
+                group["rows"] += record["rows"] or 0
+            else:
+                group["rows"] = max(group["rows"], record["rows"] or 0)
+            if record["peak_rss_mb"] is not None:
+                group["peak_rss_mb"] = max(group["peak_rss_mb"] or 0, record["peak_rss_mb"])
+        for group in aggregated.values():
+            group["rows_per_second"] = rows_per_second(group["rows"], group["wall_seconds"])
+        return aggregated
+
+
+def rows_per_second(rows: int, seconds: float):
+    if not rows or seconds <= 0:
+        return None
+    return rows / seconds
+
+
+def peak_rss_mb():
+    """Memoria residente máxima del proceso hasta el momento, None si no se puede medir."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa en KB y macOS en bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
@@ -4,18 +4,20 @@ import os
 import time
 import uuid
 from asyncio import Future
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal
 from functools import partial
-from typing import Any
+from itertools import zip_longest
+from threading import Event
 
 import pandas as pd
 import pytz
 import requests
 from dotenv import load_dotenv
 
-from libs import setup_logger, pulpo_api
+from libs import setup_logger, pulpo_api, ResultWriter, RateLimiter, StageTimer
 
 load_dotenv()
 
@@ -23,10 +25,42 @@ load_dotenv()
 PENDING_DIR = os.path.join(os.path.dirname(__file__), "pending")
 PROCESSED_DIR = os.path.join(os.path.dirname(__file__), "processed")
 ERROR_DIR = os.path.join(os.path.dirname(__file__), "error")
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+LOCATIONS_CACHE_PATH = os.path.join(CACHE_DIR, "locations.json")
+REPORTS_DIR = os.path.join(os.path.dirname(__file__), "reports")
 
 # Configuración de ThreadPoolExecutor
 MAX_WORKERS = 5
 MAX_SECONDS_TO_SLEEP = 1
+# Peticiones por segundo hacia cada endpoint, combustibles y gastos se envían en paralelo compartiendo MAX_WORKERS
+STREAM_REQUESTS_PER_SECOND = {
+    "combustibles": MAX_WORKERS / (2 * MAX_SECONDS_TO_SLEEP),
+    "gastos": MAX_WORKERS / (2 * MAX_SECONDS_TO_SLEEP),
+}
+LOCATIONS_CHUNK_SIZE = 100
+
+# Formatos de los archivos de resultados, el csv se escribe fila a fila y sobrevive a una caída del script
+OUTPUT_FORMATS = ["csv", "xlsx"]
+# Cada cuántas filas enviadas se vuelcan los resultados a los archivos de procesados y errores
+OUTPUT_FLUSH_ROWS = 100
+
+# Si es True las filas con referencias desconocidas (matrícula, tarjeta, conductor, establecimiento o producto)
+# van directo al archivo de errores de mapeo sin pasar por map_data
+PREFLIGHT_SHORT_CIRCUIT = True
+
+# Configuración por defecto del modo servicio (--daemon)
+DAEMON_DEFAULT_CONFIG = {
+    "watch_dir": "pending",
+    "working_dir": "working",
+    "processed_dir": "processed",
+    "error_dir": "error",
+    "mode": "T",
+    "max_workers": MAX_WORKERS,
+    "poll_interval_seconds": 5,
+    "settle_seconds": 2,
+    "master_data_ttl_seconds": 3600,
+    "preflight_short_circuit": PREFLIGHT_SHORT_CIRCUIT,
+}
 
 
 CUSTOM_FIELD_DEFAULT_SECTION_NAME = "Campos de Repsol"
@@ -466,54 +500,109 @@ def calculate_totals(percentage_tax: str, importe: str, importe_total: str):
     return totals
 
 
-def process_data(data: list[dict], file_name: str, is_fuel: bool, testing_mode: bool):
-    total_rows = len(data)
-    if total_rows == 0:
+def process_streams(
+    streams: list[dict],
+    source: pd.DataFrame,
+    file_name: str,
+    testing_mode: bool,
+    max_workers: int,
+):
+    """
+    Envía al API los combustibles y gastos de un archivo a la vez, compartiendo un único pool de
+    max_workers peticiones en vuelo. Cada flujo tiene su propio límite de peticiones por segundo
+    (STREAM_REQUESTS_PER_SECOND), ya que van a endpoints independientes.
+
+    Del resultado de cada fila solo se guarda su posición (y el mensaje si falló); las filas crudas se
+    seleccionan de source por posición y se escriben, en el orden del archivo, cada OUTPUT_FLUSH_ROWS filas.
+
+    :param streams: lista de flujos con las claves name, is_fuel, processed_writer, error_writer y data,
+        una lista de tuplas (posición en source, registro mapeado)
+    :param source: DataFrame original del archivo
+    """
+    streams = [stream for stream in streams if len(stream["data"]) > 0]
+    if len(streams) == 0:
         logger.info("No hay nada que procesar")
         return
 
-    processed_successfully = []
-    processed_with_errors = []
-
-    # Enumerar todos los datos una vez para evitar reiniciar row_idx
-    indexed_data = list(enumerate(data, start=1))
+    workers = max_workers if not testing_mode else 100
+    rate_limiters = {
+        stream["name"]: RateLimiter(
+            None if testing_mode else STREAM_REQUESTS_PER_SECOND[stream["name"]]
+        )
+        for stream in streams
+    }
+    results = {
+        stream["name"]: {
+            "processed_positions": [],
+            "error_positions": [],
+            "error_messages": [],
+        }
+        for stream in streams
+    }
 
-    workers = MAX_WORKERS if not testing_mode else 100
+    def flush_results(stream: dict, force: bool = False):
+        stream_results = results[stream["name"]]
+        if force or len(stream_results["processed_positions"]) >= OUTPUT_FLUSH_ROWS:
+            write_rows(
+                stream["processed_writer"],
+                source,
+                stream_results["processed_positions"],
+            )
+            stream_results["processed_positions"] = []
+        if force or len(stream_results["error_positions"]) >= OUTPUT_FLUSH_ROWS:
+            write_rows(
+                stream["error_writer"],
+                source,
+                stream_results["error_positions"],
+                stream_results["error_messages"],
+            )
+            stream_results["error_positions"] = []
+            stream_results["error_messages"] = []
+
+    def record_result(stream: dict, position: int, future: Future):
+        result = future.result()
+        stream_results = results[stream["name"]]
+        if result["success"]:
+            stream_results["processed_positions"].append(position)
+        else:
+            stream_results["error_positions"].append(position)
+            stream_results["error_messages"].append(result["error"])
+        flush_results(stream)
+
+    # Intercalamos las filas de los flujos para que ambos avancen en paralelo
+    interleaved_rows = (
+        (stream, row_idx, row)
+        for rows in zip_longest(
+            *(enumerate(stream["data"], start=1) for stream in streams),
+            fillvalue=(None, None),
+        )
+        for stream, (row_idx, row) in zip(streams, rows)
+        if row_idx is not None
+    )
 
-    # Dividimos la cantidad de filas en batches para que sean procesados en paralelo y no perder tiempo uno a uno
-    for idx in range(0, total_rows, workers):
-        batch = indexed_data[idx : idx + workers]
-        futures: list[tuple[Future, Any]] = []
-        # Inicializamos el ThreadPoolExecutor para que ejecute tantas {MAX_WORKERS} veces peticiones en paralelo
-        # Es necesario inicializar el ThreadPoolExecutor con with para garantizar el shutdown
+    # Limitamos las filas en vuelo para no encolar el archivo entero y registrar los resultados en orden
+    pending = deque()
+    try:
         with ThreadPoolExecutor(max_workers=workers) as executor:
-            for row_idx, row in batch:
+            for stream, row_idx, (position, mapped) in interleaved_rows:
                 future = executor.submit(
                     process_and_send,
-                    row["mapped"],
+                    mapped,
                     row_idx,
-                    total_rows,
+                    len(stream["data"]),
                     file_name,
-                    is_fuel,
+                    stream["is_fuel"],
                     testing_mode,
+                    rate_limiters[stream["name"]],
                 )
-                raw_row = row["raw"]
-                futures.append((future, raw_row))
-            # Esto es importante por que debemos esperar hasta que respondan todos los llamados
-            for future, raw_row in futures:
-                result = future.result()
-                if result["success"]:
-                    processed_successfully.append(raw_row)
-                else:
-                    raw_row["error"] = result["error"]
-                    processed_with_errors.append(raw_row)
-        if not testing_mode:
-            logger.info(
-                f"Esperando {MAX_SECONDS_TO_SLEEP} segundos antes de seguir con el siguiente batch"
-            )
-            time.sleep(MAX_SECONDS_TO_SLEEP)
-
-    return processed_successfully, processed_with_errors
+                pending.append((stream, position, future))
+                if len(pending) >= workers * 2:
+                    record_result(*pending.popleft())
+            while pending:
+                record_result(*pending.popleft())
+    finally:
+        for stream in streams:
+            flush_results(stream, force=True)
 
 
 # Función para procesar y transformar una fila
@@ -524,6 +613,7 @@ def process_and_send(
     file_name: str,
     is_fuel: bool,
     testing_mode: bool,
+    rate_limiter: RateLimiter,
 ):
     send_request = (
         partial(send_to_fuel_api, row) if is_fuel else partial(send_to_expense_api, row)
@@ -532,11 +622,11 @@ def process_and_send(
         logger.info(
             f"Enviando {'Combustible' if is_fuel else 'Gasto'} ({row_idx}/{total_rows}) del archivo {file_name}"
         )
-        time.sleep(MAX_SECONDS_TO_SLEEP)
         if testing_mode:
             logger.info("Testing mode activado, omitiendo envío al API")
         else:
             logger.info("Persist mode activado, enviando al API")
+            rate_limiter.acquire()
             send_request()
 
         return {"success": True}
@@ -587,64 +677,203 @@ def load_product_to_fuel_types():
     return get_json_from_file(path)
 
 
-def load_locations(codes_list: list):
-    # convert code list to simply COD_ESTABL list for remove duplicateds and conserve original info
-    simply_codes_list = [item["COD_ESTABL"] for item in codes_list]
-    simply_codes_list = list(dict.fromkeys(simply_codes_list))
+def load_locations_cache() -> dict:
+    """
+    Carga la caché persistente de establecimientos (fiscalCode -> location) del entorno actual.
+    La caché se separa por BASE_URL para no mezclar ids de staging y producción.
+    """
+    if not os.path.exists(LOCATIONS_CACHE_PATH):
+        return {}
+    try:
+        cache = get_json_from_file(LOCATIONS_CACHE_PATH)
+    except (OSError, ValueError) as e:
+        logger.warning(f"No se pudo leer la caché de establecimientos, se ignora: {e}")
+        return {}
+    return cache.get(BASE_URL, {})
+
+
+def save_locations_cache(locations_by_code: dict):
+    """
+    Guarda la caché de establecimientos del entorno actual de forma atómica.
+    """
+    ensure_directory_exists(CACHE_DIR)
+    cache = {}
+    if os.path.exists(LOCATIONS_CACHE_PATH):
+        try:
+            cache = get_json_from_file(LOCATIONS_CACHE_PATH)
+        except (OSError, ValueError):
+            cache = {}
+    cache[BASE_URL] = locations_by_code
+
+    tmp_path = f"{LOCATIONS_CACHE_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as json_file:
+        json.dump(cache, json_file, ensure_ascii=False)
+    os.replace(tmp_path, LOCATIONS_CACHE_PATH)
+
+
+def load_locations(codes_list: list, create_missing: bool = True):
+    # Indexamos COD_ESTABL -> NOM_ESTABL, eliminando duplicados y conservando el primer nombre
+    establ_names = {}
+    for item in codes_list:
+        establ_names.setdefault(item["COD_ESTABL"], item["NOM_ESTABL"])
+
+    cached_locations = load_locations_cache()
+    locations_by_code = {
+        code: cached_locations[code] for code in establ_names if code in cached_locations
+    }
+    codes_to_query = [code for code in establ_names if code not in locations_by_code]
+    logger.info(
+        f"Establecimientos en archivos {len(establ_names)}, en caché {len(locations_by_code)}, por consultar {len(codes_to_query)}"
+    )
 
-    # split simply_codes_list in list of max 100 data
-    chunk_size = 100
+    # Dividimos los códigos en grupos de máximo LOCATIONS_CHUNK_SIZE y los consultamos en paralelo
     chunks = [
-        simply_codes_list[i : i + chunk_size]
-        for i in range(0, len(simply_codes_list), chunk_size)
+        codes_to_query[i : i + LOCATIONS_CHUNK_SIZE]
+        for i in range(0, len(codes_to_query), LOCATIONS_CHUNK_SIZE)
     ]
 
     try:
-        suppliers_data = []
-        for i, chunk in enumerate(chunks):
-            suppliers = send_to_get_suppliers_by_fiscal_codes(chunk)
-            suppliers_data = suppliers_data + suppliers
-
-        logger.info(f"suppliers loaded in file {len(simply_codes_list)}")
-        logger.info(f"All suppliers loaded {len(suppliers_data)}")
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for suppliers in executor.map(send_to_get_suppliers_by_fiscal_codes, chunks):
+                for supplier in suppliers:
+                    locations_by_code[supplier["fiscalCode"]] = to_cached_location(
+                        supplier
+                    )
 
-        simply_fiscal_codes = {item["fiscalCode"] for item in suppliers_data}
         missing_fiscal_codes = [
-            code for code in simply_codes_list if code not in simply_fiscal_codes
+            code for code in codes_to_query if code not in locations_by_code
         ]
         logger.info(f"missing_fiscal_codes: {len(missing_fiscal_codes)}")
 
-        if len(missing_fiscal_codes) > 0:
+        if len(missing_fiscal_codes) > 0 and create_missing:
             uuid_namespace = uuid.UUID("0b5645c5-209e-44a7-bdaa-5c4888fc391b")
-            for idx, fiscal_code in enumerate(missing_fiscal_codes):
-                # find for get name of establ with fiscal_code for create supplier
-                establ_data = next(
-                    (item for item in codes_list if item["COD_ESTABL"] == fiscal_code),
-                    None,
-                )
-                supplier = send_to_create_supplier(establ_data, uuid_namespace)
-
-                suppliers_data.append(supplier)
-
-        return suppliers_data
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                futures = {
+                    executor.submit(
+                        send_to_create_supplier,
+                        {"COD_ESTABL": code, "NOM_ESTABL": establ_names[code]},
+                        uuid_namespace,
+                    ): code
+                    for code in missing_fiscal_codes
+                }
+                for future, fiscal_code in futures.items():
+                    try:
+                        supplier = future.result()
+                    except ValueError as e:
+                        # El registro quedará en el archivo de errores de mapeo
+                        logger.error(
+                            f"No se pudo crear el establecimiento {fiscal_code}: {e}"
+                        )
+                        continue
+                    locations_by_code[fiscal_code] = to_cached_location(supplier)
+
+        logger.info(f"All suppliers loaded {len(locations_by_code)}")
+        save_locations_cache({**cached_locations, **locations_by_code})
+
+        return list(locations_by_code.values())
     except requests.RequestException as e:
         logging.error(f"HTTP Request failed: {e}")
         raise
 
 
-def get_establ_codes_list(files: list):
-    codes_list = []
-    for idx, file_name in enumerate(files, start=1):
-        file_path = os.path.join(PENDING_DIR, file_name)
-        df = pd.read_excel(file_path, sheet_name=0, dtype=str)
+def to_cached_location(supplier: dict) -> dict:
+    return {"id": supplier["id"], "fiscalCode": supplier["fiscalCode"]}
 
-        df["COD_ESTABL"] = df["COD_ESTABL"].str.zfill(15)
-        df_ab = df[["NOM_ESTABL", "COD_ESTABL"]]
-        json_value = df_ab.to_dict(orient="records")
-        codes_list = codes_list + json_value
 
-    clean_list = [dict(t) for t in {tuple(d.items()) for d in codes_list}]
-    return clean_list
+def get_establ_codes(df: pd.DataFrame) -> list:
+    # Nos quedamos con los pares COD_ESTABL / NOM_ESTABL distintos del archivo
+    establ_codes = pd.DataFrame(
+        {
+            "NOM_ESTABL": df["NOM_ESTABL"],
+            "COD_ESTABL": df["COD_ESTABL"].str.zfill(15),
+        }
+    ).drop_duplicates()
+    return establ_codes.to_dict(orient="records")
+
+
+def is_s3_uri(source: str) -> bool:
+    return source.startswith("s3://")
+
+
+def get_s3_client():
+    try:
+        import boto3
+    except ImportError:
+        raise ValueError(
+            "Para leer archivos de S3 es necesario instalar boto3 (pip install boto3)"
+        )
+    return boto3.client("s3")
+
+
+def split_s3_uri(uri: str) -> tuple:
+    bucket, _, key = uri[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def expand_sources(sources: list) -> list:
+    """
+    Expande los orígenes indicados por línea de comandos: las carpetas locales y los prefijos de S3
+    terminados en / se convierten en la lista de archivos de operaciones que contienen.
+    """
+    expanded = []
+    for source in sources:
+        if is_s3_uri(source) and source.endswith("/"):
+            bucket, prefix = split_s3_uri(source)
+            paginator = get_s3_client().get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                expanded.extend(
+                    f"s3://{bucket}/{content['Key']}"
+                    for content in page.get("Contents", [])
+                    if is_operations_file(content["Key"])
+                )
+        elif not is_s3_uri(source) and os.path.isdir(source):
+            expanded.extend(
+                os.path.join(source, file_name)
+                for file_name in sorted(os.listdir(source))
+                if is_operations_file(file_name)
+            )
+        else:
+            expanded.append(source)
+    return expanded
+
+
+def read_operations(source: str) -> pd.DataFrame:
+    """
+    Lee un archivo de operaciones como texto. Acepta .xls/.xlsx y .csv locales o URIs s3://bucket/key;
+    los csv de S3 se leen directamente del cuerpo del objeto, sin descargarlos a disco.
+    Las columnas se normalizan a mayúsculas y se renombran según maps/csv_column_aliases.json
+    para que el csv del feed de operaciones liquidadas tenga los mismos nombres que el Excel de misolred.
+    """
+    if is_s3_uri(source):
+        bucket, key = split_s3_uri(source)
+        body = get_s3_client().get_object(Bucket=bucket, Key=key)["Body"]
+        if key.lower().endswith(".csv"):
+            df = pd.read_csv(body, dtype=str, keep_default_na=False)
+        else:
+            # read_excel necesita un archivo con acceso aleatorio
+            from io import BytesIO
+
+            df = pd.read_excel(
+                BytesIO(body.read()), sheet_name=0, dtype=str, keep_default_na=False
+            )
+    elif source.lower().endswith(".csv"):
+        df = pd.read_csv(source, dtype=str, keep_default_na=False)
+    else:
+        df = pd.read_excel(source, sheet_name=0, dtype=str, keep_default_na=False)
+
+    return normalize_columns(df)
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    aliases = load_csv_column_aliases()
+    columns = [str(column).strip().upper() for column in df.columns]
+    df.columns = [aliases.get(column, column) for column in columns]
+    return df
+
+
+def load_csv_column_aliases() -> dict:
+    path = os.path.join(os.path.dirname(__file__), "maps", "csv_column_aliases.json")
+    return get_json_from_file(path)
 
 
 def send_to_get_suppliers_by_fiscal_codes(fiscal_codes: list):
@@ -689,6 +918,8 @@ def send_to_create_supplier(establ_data, uuid_namespace):
     response = requests.post(
         f"{BASE_URL}/suppliers/1/locations", json=supplier, headers=headers
     )
+    if response.status_code not in (200, 201):
+        raise ValueError(f"Error: {response.status_code} {response.text}")
     return response.json()
 
 
@@ -735,24 +966,44 @@ def get_operation_type_info(
     )
 
 
-def save_raw_data(data, file_name: str, suffix: str, dir: str):
+def open_raw_writer(file_name: str, suffix: str, dir: str, columns: list):
     """
-    Guarda los datos crudos en un nuevo archivo Excel en la carpeta 'processed'.
+    Abre un writer incremental para guardar datos crudos en la carpeta indicada.
 
-    :param data: lista de diccionarios con datos crudos
     :param file_name: nombre del archivo original
     :param suffix: sufijo para distinguir entre combustibles y gastos
     :param dir: el directorio donde se almacenara el archivo
+    :param columns: columnas del archivo original (más la columna de error si aplica)
     """
-    ensure_directory_exists(dir)
-    df_raw = pd.DataFrame(data)  # .from_dict()  # Crear DataFrame con los datos crudos
     base_name = os.path.splitext(file_name)[0]  # Elimina la extensión del archivo
-    new_file_name = f"{base_name}_{suffix}.xlsx"
-    output_path = os.path.join(dir, new_file_name)
+    return ResultWriter(
+        os.path.join(dir, f"{base_name}_{suffix}"), OUTPUT_FORMATS, columns
+    )
+
+
+def write_rows(
+    writer: ResultWriter,
+    source: pd.DataFrame,
+    positions: list,
+    error_messages: list = None,
+):
+    """
+    Escribe en el writer las filas de source indicadas por posición, con la columna error si se indican mensajes.
+    """
+    if len(positions) == 0:
+        return
+    rows = source.iloc[positions]
+    if error_messages is not None:
+        rows = rows.assign(error=error_messages)
+    writer.write_many(rows.to_dict(orient="records"))
+
 
-    # Guardar el DataFrame como Excel
-    df_raw.to_excel(output_path, index=False)
-    logger.info(f"Archivo {new_file_name} guardado en ${dir}")
+def log_saved_files(*writers: ResultWriter):
+    for writer in writers:
+        for path in writer.paths:
+            logger.info(
+                f"Archivo {os.path.basename(path)} guardado en {os.path.dirname(path)} ({writer.count} filas)"
+            )
 
 
 def ensure_directory_exists(directory):
@@ -799,21 +1050,940 @@ def configure_fuels_custom_fields(required_custom_fieds: list, type: str):
         )
 
 
-# Script principal
-def main():
-    # Listar archivos en carpeta 'pending'
-    files = [
-        f for f in os.listdir(PENDING_DIR) if f.endswith(".xls") or f.endswith(".xlsx")
+def load_master_data():
+    """
+    Precarga los datos maestros de la cuenta necesarios para mapear las operaciones.
+    """
+    vehicles, drivers, payment_methods, fuel_type_of_fuels, expense_types = (
+        get_all_entities()
+    )
+    return {
+        "vehicles": vehicles,
+        "drivers": drivers,
+        "payment_methods": payment_methods,
+        "fuel_type_of_fuels": fuel_type_of_fuels,
+        "expense_types": expense_types,
+        "product_to_expense_types": load_product_to_expense_types(),
+        "product_to_fuel_types": load_product_to_fuel_types(),
+    }
+
+
+def configure_custom_fields():
+    configure_fuels_custom_fields(EXPENSES_CUSTOM_FIELDS_DEFINITION, "expenses")
+    configure_fuels_custom_fields(FUELS_CUSTOM_FIELDS_DEFINITION, "fuels")
+
+
+def is_operations_file(file_name: str) -> bool:
+    return file_name.lower().endswith((".xls", ".xlsx", ".csv"))
+
+
+def process_file(
+    file_path: str,
+    master_data: dict,
+    locations: list,
+    testing_mode: bool,
+    max_workers: int = MAX_WORKERS,
+    short_circuit: bool = PREFLIGHT_SHORT_CIRCUIT,
+    timer: StageTimer = None,
+    df: pd.DataFrame = None,
+):
+    """
+    Mapea y envía las operaciones de un archivo, generando los archivos de procesados y errores.
+
+    :param file_path: ruta local o URI s3:// del archivo de operaciones
+    :param master_data: datos maestros devueltos por load_master_data
+    :param locations: establecimientos devueltos por load_locations
+    :param testing_mode: si es True no se envía nada al API
+    :param max_workers: peticiones en paralelo hacia el API
+    :param short_circuit: si es True las filas con referencias desconocidas en el pre-chequeo van directo
+        a mapeo_error sin pasar por map_data
+    :param timer: acumula los tiempos de lectura, mapeo, envío y escritura del archivo
+    :param df: contenido del archivo si ya se leyó con read_operations, para no leerlo dos veces
+    """
+    timer = timer or StageTimer()
+    file_name = os.path.basename(file_path)
+    if df is None:
+        with timer.stage("lectura", file_name) as stage:
+            df = read_operations(file_path)
+            stage["rows"] = len(df)
+    total_rows = len(df)
+
+    if total_rows == 0:
+        logger.info(f"No hay nada que procesar en el archivo {file_name}, omitiendo...")
+        return
+
+    columns = list(df.columns)
+    error_columns = columns + ["error"]
+
+    with timer.stage("pre_chequeo", file_name, total_rows):
+        preflight_errors = run_reference_preflight(
+            df, master_data, locations, file_name
+        )
+
+    # Bucle para mapear filas, de cada fila solo se guarda su posición en df y el registro mapeado o el error
+    logger.info("Mapeando datos...")
+    fuels = []
+    expenses = []
+    error_positions = []
+    error_messages = []
+    column_values = [df[column].to_numpy() for column in columns]
+    mapped_error = open_raw_writer(file_name, "mapeo_error", ERROR_DIR, error_columns)
+    with timer.stage("mapeo", file_name, total_rows):
+        for position, preflight_error in enumerate(preflight_errors):
+            if short_circuit and isinstance(preflight_error, str):
+                error_positions.append(position)
+                error_messages.append(preflight_error)
+                continue
+
+            row_idx = position + 1
+            logger.info(f"Mapeando ({row_idx}/{total_rows}) filas")
+            row_dict = {
+                column: values[position]
+                for column, values in zip(columns, column_values)
+            }
+            mapping_result = try_to_map_data(
+                row_idx,
+                row_dict,
+                file_name,
+                master_data["vehicles"],
+                master_data["drivers"],
+                master_data["payment_methods"],
+                locations,
+                master_data["product_to_fuel_types"],
+                master_data["fuel_type_of_fuels"],
+                master_data["product_to_expense_types"],
+                master_data["expense_types"],
+            )
+            if mapping_result["success"]:
+                data = mapping_result["data"]
+                if data["is_fuel"]:
+                    fuels.append((position, data["mapped"]))
+                else:
+                    expenses.append((position, data["mapped"]))
+            else:
+                error_positions.append(position)
+                error_messages.append(mapping_result["error"])
+        write_rows(mapped_error, df, error_positions, error_messages)
+        mapped_error.close()
+
+    # Si ocurre un error de mapeo se genera el archivo correspondiente y sigue ejecutando
+    if mapped_error.count != 0:
+        logger.info("Datos mapeados pero con errores")
+        log_saved_files(mapped_error)
+    else:
+        logger.info("Datos mapeados exitosamente")
+
+    fuels_len = len(fuels)
+    logger.info(f"Combustibles totales: {fuels_len}")
+    expenses_len = len(expenses)
+    logger.info(f"Gastos totales: {expenses_len}")
+
+    if fuels_len == 0 and expenses_len == 0:
+        raise ValueError(
+            "Hubo un error al obtener registros de combustibles y gastos, por favor verifique los datos y los errores"
+        )
+
+    logger.info("Procesando Combustibles y Gastos")
+    processed_fuels = open_raw_writer(file_name, "combustibles", PROCESSED_DIR, columns)
+    error_fuels = open_raw_writer(file_name, "combustibles_error", ERROR_DIR, error_columns)
+    processed_expenses = open_raw_writer(file_name, "gastos", PROCESSED_DIR, columns)
+    error_expenses = open_raw_writer(file_name, "gastos_error", ERROR_DIR, error_columns)
+    writers = [processed_fuels, error_fuels, processed_expenses, error_expenses]
+    try:
+        with timer.stage("envio", file_name, fuels_len + expenses_len):
+            process_streams(
+                [
+                    {
+                        "name": "combustibles",
+                        "is_fuel": True,
+                        "data": fuels,
+                        "processed_writer": processed_fuels,
+                        "error_writer": error_fuels,
+                    },
+                    {
+                        "name": "gastos",
+                        "is_fuel": False,
+                        "data": expenses,
+                        "processed_writer": processed_expenses,
+                        "error_writer": error_expenses,
+                    },
+                ],
+                df,
+                file_name,
+                testing_mode,
+                max_workers,
+            )
+    finally:
+        # El csv se escribe durante el envío, aquí se mide el cierre de los archivos (guardado del xlsx)
+        with timer.stage(
+            "escritura", file_name, sum(writer.count for writer in writers)
+        ):
+            for writer in writers:
+                writer.close()
+    log_saved_files(*writers)
+
+    logger.info(f"Archivo {file_name} procesado completamente")
+
+
+# Causas de error del modo validación, en el mismo orden en que las evalúa map_data
+VALIDATION_CAUSES = [
+    "vehiculo_no_existe",
+    "medio_de_pago_invalido",
+    "medio_de_pago_no_existe",
+    "conductor_no_existe",
+    "establecimiento_no_existe",
+    "fecha_invalida",
+    "kilometros_invalidos",
+    "producto_no_reconocido",
+    "importes_invalidos",
+    "total_no_cuadra",
+    "tipo_sin_catalogo",
+    "litros_invalidos",
+]
+VALIDATION_ROW_COLUMNS = [
+    "MATRICULA",
+    "NUM_TARJET",
+    "COD_CONDUCTOR",
+    "COD_ESTABL",
+    "COD_PRODU",
+    "FEC_OPERAC",
+    "HOR_OPERAC",
+    "IVA",
+    "IMPORTE",
+    "IMP_TOTAL",
+]
+
+
+def map_distinct(series: pd.Series, func) -> pd.Series:
+    """
+    Aplica func una sola vez por cada valor distinto de la serie y reparte el resultado a todas las filas.
+    Si func falla para un valor, el resultado de ese valor es None.
+    """
+
+    def safe_func(value):
+        try:
+            return func(value)
+        except (ValueError, TypeError, KeyError, ArithmeticError):
+            return None
+
+    return series.map({value: safe_func(value) for value in series.unique()})
+
+
+def classify_products(master_data: dict) -> dict:
+    """
+    Indexa codigo_producto -> (tipo de operación, tiene catálogo en la cuenta), conservando la prioridad
+    de get_operation_type_info: primero combustibles y luego gastos.
+    """
+    fuel_reference_codes = {
+        int(item["referenceCode"])
+        for item in master_data["fuel_type_of_fuels"]
+        if item["referenceCode"] is not None
+    }
+    expense_reference_codes = {
+        int(item["referenceCode"])
+        for item in master_data["expense_types"]
+        if item["referenceCode"] is not None
+    }
+    products = {}
+    for item in master_data["product_to_expense_types"]:
+        products[item["codigo_producto"]] = (
+            "gasto",
+            item["pulpo"]["reference_code"] in expense_reference_codes,
+        )
+    for item in master_data["product_to_fuel_types"]:
+        products[item["codigo_producto"]] = (
+            "combustible",
+            item["pulpo"]["reference_code"] in fuel_reference_codes,
+        )
+    return products
+
+
+def find_unknown_references(
+    df: pd.DataFrame, master_data: dict, locations: list
+) -> pd.DataFrame:
+    """
+    Cruza los valores distintos de MATRICULA, NUM_TARJET, COD_CONDUCTOR, COD_ESTABL y COD_PRODU contra
+    índices de los datos maestros, en vez de recorrer las listas por cada fila como hace map_data.
+
+    :return: DataFrame alineado con df con el número de tarjeta normalizado, el tipo de operación,
+        si el producto no tiene catálogo y una columna booleana por cada referencia desconocida
+    """
+    vehicle_registrations = {
+        vehicle["registration_number"] for vehicle in master_data["vehicles"]
+    }
+    payment_method_slugs = {
+        payment_method["slug"] for payment_method in master_data["payment_methods"]
+    }
+    driver_names = {driver["name"] for driver in master_data["drivers"]}
+    location_codes = {int(location["fiscalCode"]) for location in locations}
+    products = classify_products(master_data)
+
+    references = pd.DataFrame(index=df.index)
+
+    registrations = df["MATRICULA"].str.replace(r"[^a-zA-Z0-9]", "", regex=True)
+    references["vehiculo_no_existe"] = (registrations != "") & ~registrations.isin(
+        vehicle_registrations
+    )
+
+    card_slugs = map_distinct(
+        df["NUM_TARJET"], lambda value: f"{int(value)}" if is_not_empty(value) else ""
+    )
+    references["tarjeta"] = card_slugs
+    references["medio_de_pago_invalido"] = card_slugs.isna()
+    references["medio_de_pago_no_existe"] = (
+        card_slugs.notna()
+        & ~card_slugs.isin(["", "0"])
+        & ~card_slugs.isin(payment_method_slugs)
+    )
+
+    if "COD_CONDUCTOR" in df.columns:
+        references["conductor_no_existe"] = (df["COD_CONDUCTOR"] != "") & ~df[
+            "COD_CONDUCTOR"
+        ].isin(driver_names)
+    else:
+        references["conductor_no_existe"] = False
+
+    known_locations = map_distinct(
+        df["COD_ESTABL"], lambda value: int(value) in location_codes
+    )
+    references["establecimiento_no_existe"] = ~known_locations.eq(True)
+
+    references["tipo_operacion"] = map_distinct(
+        df["COD_PRODU"], lambda value: products[int(value)][0]
+    )
+    references["producto_no_reconocido"] = references["tipo_operacion"].isna()
+    references["sin_catalogo"] = map_distinct(
+        df["COD_PRODU"], lambda value: not products[int(value)][1]
+    ).eq(True)
+
+    return references
+
+
+def count_unknown_references(df: pd.DataFrame, references: pd.DataFrame) -> dict:
+    """
+    Agrupa los valores desconocidos de cada columna clave con su número de ocurrencias.
+    """
+    unknown_values = {
+        "matriculas": df.loc[references["vehiculo_no_existe"], "MATRICULA"],
+        "tarjetas": references.loc[references["medio_de_pago_no_existe"], "tarjeta"],
+        "conductores": (
+            df.loc[references["conductor_no_existe"], "COD_CONDUCTOR"]
+            if "COD_CONDUCTOR" in df.columns
+            else pd.Series(dtype=str)
+        ),
+        "establecimientos": df.loc[
+            references["establecimiento_no_existe"], "COD_ESTABL"
+        ],
+        "productos": df.loc[references["producto_no_reconocido"], "COD_PRODU"],
+        "productos_sin_catalogo": df.loc[references["sin_catalogo"], "COD_PRODU"],
+    }
+    return {
+        key: {str(value): int(count) for value, count in values.value_counts().items()}
+        for key, values in unknown_values.items()
+    }
+
+
+def run_reference_preflight(
+    df: pd.DataFrame, master_data: dict, locations: list, file_name: str
+) -> pd.Series:
+    """
+    Pre-chequeo de referencias antes de mapear fila a fila: informa las entidades que no existen con sus
+    ocurrencias y devuelve, para cada fila, el error que daría map_data por una referencia desconocida
+    (nulo si no tiene ninguna). Las filas con un NUM_TARJET no numérico se dejan a map_data.
+
+    :return: serie alineada con df con el mensaje de error de cada fila
+    """
+    references = find_unknown_references(df, master_data, locations)
+    unknown = {
+        key: values
+        for key, values in count_unknown_references(df, references).items()
+        if values and key != "productos_sin_catalogo"
+    }
+    if not unknown:
+        logger.info(f"Pre-chequeo de referencias sin errores en {file_name}")
+        return pd.Series(None, index=df.index, dtype=object)
+
+    for key, values in unknown.items():
+        logger.info(
+            f"Pre-chequeo {file_name}: {len(values)} {key} no existen en {sum(values.values())} filas"
+        )
+        for value, count in list(values.items())[:10]:
+            logger.info(f"  {value}: {count}")
+
+    ensure_directory_exists(REPORTS_DIR)
+    report_path = os.path.join(
+        REPORTS_DIR, f"{os.path.splitext(file_name)[0]}_referencias.json"
+    )
+    with open(report_path, "w", encoding="utf-8") as json_file:
+        json.dump(unknown, json_file, ensure_ascii=False, indent=2)
+    logger.info(f"Referencias desconocidas guardadas en {report_path}")
+
+    card_missing = references["medio_de_pago_no_existe"]
+    vehicle_missing = references["vehiculo_no_existe"]
+    # Mismos mensajes que map_data, asignados de la última a la primera comprobación para que quede el primero
+    messages = pd.Series(None, index=df.index, dtype=object)
+    messages = messages.mask(
+        references["producto_no_reconocido"],
+        "Tipo de operación " + df["COD_PRODU"] + " no reconocida",
+    )
+    messages = messages.mask(
+        references["establecimiento_no_existe"],
+        "El proveedor con el codigo " + df["COD_ESTABL"] + " no existe",
+    )
+    if "COD_CONDUCTOR" in df.columns:
+        messages = messages.mask(
+            references["conductor_no_existe"],
+            "El conductor con el nombre " + df["COD_CONDUCTOR"] + " no existe",
+        )
+    messages = messages.mask(
+        card_missing,
+        "El medio de pago con el número " + references["tarjeta"] + " no existe",
+    )
+    messages = messages.mask(
+        vehicle_missing,
+        "El vehículo con la placa " + df["MATRICULA"] + " no existe",
+    )
+    messages = messages.mask(
+        vehicle_missing & card_missing,
+        "El vehículo con la placa "
+        + df["MATRICULA"]
+        + " y el medio de pago con el número "
+        + references["tarjeta"]
+        + " no existen",
+    )
+    return messages.where(~references["medio_de_pago_invalido"])
+
+
+def validate_operations(df: pd.DataFrame, master_data: dict, locations: list):
+    """
+    Ejecuta sobre todo el DataFrame las mismas comprobaciones de map_data y calculate_totals, por columnas
+    y sin llamar al API. Las búsquedas se resuelven una vez por valor distinto.
+
+    :return: DataFrame de booleanos con una columna por causa de VALIDATION_CAUSES, serie con el tipo de
+        operación de cada fila y diccionario con los valores desconocidos y sus ocurrencias
+    """
+    references = find_unknown_references(df, master_data, locations)
+
+    causes = pd.DataFrame(False, index=df.index, columns=VALIDATION_CAUSES)
+    for cause in [
+        "vehiculo_no_existe",
+        "medio_de_pago_invalido",
+        "medio_de_pago_no_existe",
+        "conductor_no_existe",
+        "establecimiento_no_existe",
+        "producto_no_reconocido",
+    ]:
+        causes[cause] = references[cause]
+    causes["tipo_sin_catalogo"] = references["sin_catalogo"]
+    operation_types = references["tipo_operacion"]
+
+    dates = pd.to_datetime(
+        df["FEC_OPERAC"].str[:10].str.replace("-", "", regex=False)
+        + " "
+        + df["HOR_OPERAC"],
+        format="%Y%m%d %H%M",
+        errors="coerce",
+    )
+    causes["fecha_invalida"] = dates.isna()
+
+    causes["kilometros_invalidos"] = ~df["KILOMETROS"].str.strip().str.fullmatch(
+        r"[+-]?\d+"
+    )
+
+    percentage_tax = pd.to_numeric(df["IVA"], errors="coerce")
+    importe = pd.to_numeric(df["IMPORTE"], errors="coerce")
+    importe_total = pd.to_numeric(df["IMP_TOTAL"], errors="coerce")
+    causes["importes_invalidos"] = (
+        percentage_tax.isna() | importe.isna() | importe_total.isna()
+    )
+
+    # Mismo cálculo que calculate_totals, en float por columnas
+    tax_subtraction = 1 + percentage_tax / 100
+    subtotal = importe / tax_subtraction
+    calculated_discount = ((importe_total - importe) / tax_subtraction).where(
+        importe.abs() > importe_total.abs(), 0
+    )
+    calculated_tax = (subtotal + calculated_discount) * (percentage_tax / 100)
+    calculated_total = subtotal + calculated_discount + calculated_tax
+    causes["total_no_cuadra"] = (
+        ~causes["importes_invalidos"]
+        & ((importe_total - calculated_total).abs() > 0.0001)
+    )
+
+    liters = pd.to_numeric(df["NUM_LITROS"], errors="coerce")
+    causes["litros_invalidos"] = operation_types.eq("combustible") & liters.isna()
+
+    return causes, operation_types, count_unknown_references(df, references)
+
+
+def validate_file(
+    file_path: str, master_data: dict, rows_writer: ResultWriter
+) -> dict:
+    """
+    Valida un archivo completo sin enviar nada al API y escribe las filas con error en rows_writer.
+
+    :return: resumen del archivo con los errores agrupados por causa y los valores desconocidos
+    """
+    file_name = os.path.basename(file_path)
+    df = read_operations(file_path)
+    locations = load_locations(get_establ_codes(df), create_missing=False)
+    causes, operation_types, unknown = validate_operations(df, master_data, locations)
+
+    has_error = causes.any(axis=1)
+    error_positions = has_error.to_numpy().nonzero()[0]
+    row_columns = [column for column in VALIDATION_ROW_COLUMNS if column in df.columns]
+    error_causes = causes.iloc[error_positions]
+    cause_names = error_causes.apply(
+        lambda row: ", ".join(row.index[row.to_numpy()]), axis=1
+    )
+    for position, row, row_causes in zip(
+        error_positions,
+        df.iloc[error_positions][row_columns].to_dict(orient="records"),
+        cause_names,
+    ):
+        rows_writer.write(
+            {"archivo": file_name, "fila": int(position) + 1, "causas": row_causes, **row}
+        )
+
+    summary = {
+        "archivo": file_name,
+        "filas": len(df),
+        "filas_con_error": int(has_error.sum()),
+        "combustibles": int(operation_types.eq("combustible").sum()),
+        "gastos": int(operation_types.eq("gasto").sum()),
+        "errores_por_causa": {
+            cause: int(count) for cause, count in causes.sum().items() if count > 0
+        },
+        "desconocidos": unknown,
+    }
+    logger.info(
+        f"Archivo {file_name} validado: {summary['filas']} filas, {summary['filas_con_error']} con errores"
+    )
+    for cause, count in summary["errores_por_causa"].items():
+        logger.info(f"  {cause}: {count}")
+    return summary
+
+
+def merge_validation_summaries(summaries: list) -> dict:
+    total = {
+        "filas": 0,
+        "filas_con_error": 0,
+        "combustibles": 0,
+        "gastos": 0,
+        "errores_por_causa": {},
+        "desconocidos": {},
+    }
+    for summary in summaries:
+        for key in ["filas", "filas_con_error", "combustibles", "gastos"]:
+            total[key] += summary[key]
+        for cause, count in summary["errores_por_causa"].items():
+            total["errores_por_causa"][cause] = (
+                total["errores_por_causa"].get(cause, 0) + count
+            )
+        for key, values in summary["desconocidos"].items():
+            merged = total["desconocidos"].setdefault(key, {})
+            for value, count in values.items():
+                merged[value] = merged.get(value, 0) + count
+    for key, values in total["desconocidos"].items():
+        total["desconocidos"][key] = dict(
+            sorted(values.items(), key=lambda item: item[1], reverse=True)
+        )
+    return total
+
+
+def run_validation(file_paths: list):
+    """
+    Modo validación: comprueba todos los archivos sin pausas ni envíos al API y genera un único reporte
+    en la carpeta reports con el resumen en JSON y las filas con error en csv.
+    Los establecimientos que no existen no se crean, en una carga normal se crearían automáticamente.
+    """
+    if len(file_paths) == 0:
+        logger.info(
+            "No hay archivos que validar, verifique que hayan en la carpeta de /pending"
+        )
+        return
+
+    master_data = load_master_data()
+
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    base_path = os.path.join(REPORTS_DIR, f"validacion_{timestamp}")
+    summaries = []
+    with ResultWriter(
+        f"{base_path}_filas",
+        ["csv"],
+        ["archivo", "fila", "causas"] + VALIDATION_ROW_COLUMNS,
+    ) as rows_writer:
+        for idx, file_path in enumerate(file_paths, start=1):
+            logger.info(
+                f"Validando archivo {os.path.basename(file_path)} ({idx}/{len(file_paths)})"
+            )
+            summaries.append(
+                validate_file(file_path, master_data, rows_writer)
+            )
+
+    report = {
+        "fecha": datetime.now().isoformat(),
+        "resumen": merge_validation_summaries(summaries),
+        "archivos": summaries,
+    }
+    ensure_directory_exists(REPORTS_DIR)
+    with open(f"{base_path}.json", "w", encoding="utf-8") as json_file:
+        json.dump(report, json_file, ensure_ascii=False, indent=2)
+
+    logger.info(f"Reporte de validación guardado en {base_path}.json")
+    log_saved_files(rows_writer)
+    return report
+
+
+# Tolerancia para considerar que el total de una operación en Pulpo coincide con el del archivo
+RECONCILE_AMOUNT_TOLERANCE = 0.01
+RECONCILE_PAGE_SIZE = 500
+
+
+def to_minute_key(value) -> str:
+    """Normaliza una fecha a UTC truncada al minuto, las fechas sin zona horaria se consideran UTC."""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC").floor("min").isoformat()
+
+
+def get_related_id(record: dict, name: str):
+    """Devuelve record[nameId] o record[name][id], según cómo venga la relación en la respuesta del API."""
+    related_id = record.get(f"{name}Id")
+    if related_id is None and isinstance(record.get(name), dict):
+        related_id = record[name].get("id")
+    return related_id
+
+
+def get_custom_field(record: dict, name: str):
+    """
+    Devuelve un campo personalizado del registro, customFieldsMetadata puede venir como json en texto
+    (combustibles) o como diccionario (gastos).
+    """
+    metadata = record.get("customFieldsMetadata")
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            return None
+    if not isinstance(metadata, dict):
+        return None
+    return metadata.get(name)
+
+
+def operation_fingerprint(
+    kind: str, date, payment_method_id, vehicle_id, location_id
+) -> tuple:
+    return (kind, to_minute_key(date), payment_method_id, vehicle_id, location_id)
+
+
+def map_file_operations(
+    df: pd.DataFrame, file_name: str, master_data: dict, locations: list
+):
+    """
+    Mapea las filas del archivo igual que en la carga y devuelve la huella de cada operación.
+
+    :return: lista de operaciones (posición, tipo, huella y total) y lista de (posición, error) de las
+        filas que no se pudieron mapear
+    """
+    columns = list(df.columns)
+    column_values = [df[column].to_numpy() for column in columns]
+    operations = []
+    unmapped = []
+    for position in range(len(df)):
+        row_dict = {
+            column: values[position] for column, values in zip(columns, column_values)
+        }
+        mapping_result = try_to_map_data(
+            position + 1,
+            row_dict,
+            file_name,
+            master_data["vehicles"],
+            master_data["drivers"],
+            master_data["payment_methods"],
+            locations,
+            master_data["product_to_fuel_types"],
+            master_data["fuel_type_of_fuels"],
+            master_data["product_to_expense_types"],
+            master_data["expense_types"],
+        )
+        if not mapping_result["success"]:
+            unmapped.append((position, mapping_result["error"]))
+            continue
+
+        mapped = mapping_result["data"]["mapped"]
+        kind = "combustible" if mapping_result["data"]["is_fuel"] else "gasto"
+        operations.append(
+            {
+                "position": position,
+                "kind": kind,
+                "date": mapped["date"],
+                "total": mapped["total"],
+                "fingerprint": operation_fingerprint(
+                    kind,
+                    mapped["date"],
+                    mapped["paymentMethodId"],
+                    mapped["vehicleId"],
+                    mapped["locationId"],
+                ),
+            }
+        )
+    return operations, unmapped
+
+
+def date_range_filter(start_date: str, end_date: str) -> dict:
+    return {
+        "AND": [
+            {"parent": "date", "date": {"gte": start_date, "lte": end_date}},
+        ]
+    }
+
+
+def fetch_remote_operations(start_date: str, end_date: str, account_ids: set) -> list:
+    """
+    Descarga por páginas, en paralelo, los combustibles y gastos de Repsol de la cuenta entre dos fechas.
+    El rango se vuelve a aplicar en local por si el API no aplica el filtro.
+
+    :param account_ids: cuentas de cliente de Repsol (COD_CLI) del archivo, las operaciones de otras
+        cuentas (cf_repsolv2_id_cuenta) se descartan
+    """
+    q = date_range_filter(start_date, end_date)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        fuels_future = executor.submit(
+            api.get_all_fuels, q, RECONCILE_PAGE_SIZE, MAX_WORKERS
+        )
+        expenses_future = executor.submit(
+            api.get_all_expenses, q, RECONCILE_PAGE_SIZE, MAX_WORKERS
+        )
+        remote_records = [("combustible", record) for record in fuels_future.result()]
+        remote_records += [("gasto", record) for record in expenses_future.result()]
+
+    start_key = to_minute_key(start_date)
+    end_key = to_minute_key(end_date)
+    operations = []
+    for kind, record in remote_records:
+        if get_related_id(record, "supplier") != 1:
+            continue  # Solo las operaciones del proveedor Repsol
+        account_id = get_custom_field(record, "cf_repsolv2_id_cuenta")
+        if account_id is None or str(account_id).strip() not in account_ids:
+            continue
+        date_key = to_minute_key(record["date"])
+        if not start_key <= date_key <= end_key:
+            continue
+        operations.append(
+            {
+                "id": record.get("id"),
+                "kind": kind,
+                "date": record["date"],
+                "total": record.get("total"),
+                "fingerprint": operation_fingerprint(
+                    kind,
+                    record["date"],
+                    get_related_id(record, "paymentMethod"),
+                    get_related_id(record, "vehicle"),
+                    get_related_id(record, "location"),
+                ),
+            }
+        )
+    logger.info(
+        f"Operaciones en Pulpo entre {start_date} y {end_date}: {len(operations)}"
+    )
+    return operations
+
+
+def reconcile_operations(file_operations: list, remote_operations: list) -> dict:
+    """
+    Cruza por huella las operaciones del archivo con las de Pulpo. Si una huella se repite, las operaciones
+    se emparejan en orden y las que sobran de un lado quedan como faltantes o sobrantes.
+
+    :return: diccionario con las listas missing, extra y amount_mismatch
+    """
+    remote_by_fingerprint = {}
+    for operation in remote_operations:
+        remote_by_fingerprint.setdefault(operation["fingerprint"], deque()).append(
+            operation
+        )
+
+    missing = []
+    amount_mismatch = []
+    for operation in file_operations:
+        candidates = remote_by_fingerprint.get(operation["fingerprint"])
+        if not candidates:
+            missing.append(operation)
+            continue
+        remote = candidates.popleft()
+        remote_total = float(remote["total"]) if remote["total"] is not None else None
+        if (
+            remote_total is None
+            or abs(remote_total - operation["total"]) > RECONCILE_AMOUNT_TOLERANCE
+        ):
+            amount_mismatch.append((operation, remote))
+
+    extra = [
+        operation
+        for candidates in remote_by_fingerprint.values()
+        for operation in candidates
     ]
-    if len(files) == 0:
+    return {"missing": missing, "extra": extra, "amount_mismatch": amount_mismatch}
+
+
+def reconcile_file(file_path: str, master_data: dict) -> dict:
+    """
+    Concilia un archivo contra las operaciones ya cargadas en Pulpo y guarda en reports los faltantes,
+    sobrantes y diferencias de importe.
+    """
+    file_name = os.path.basename(file_path)
+    base_name = os.path.splitext(file_name)[0]
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    base_path = os.path.join(REPORTS_DIR, f"conciliacion_{base_name}_{timestamp}")
+
+    df = read_operations(file_path)
+    locations = load_locations(get_establ_codes(df), create_missing=False)
+    file_operations, unmapped = map_file_operations(
+        df, file_name, master_data, locations
+    )
+    if len(file_operations) == 0:
+        raise ValueError(f"No se pudo mapear ninguna operación del archivo {file_name}")
+
+    # Se descarga un día más a cada lado para emparejar las operaciones desplazadas por la zona horaria
+    dates = pd.to_datetime([operation["date"] for operation in file_operations], utc=True)
+    file_start = dates.min().floor("D")
+    file_end = dates.max().floor("D") + pd.Timedelta(days=1)
+    start_date = (file_start - pd.Timedelta(days=1)).isoformat()
+    end_date = (file_end + pd.Timedelta(days=1)).isoformat()
+    account_ids = {value.strip() for value in df["COD_CLI"] if value.strip()}
+    remote_operations = fetch_remote_operations(start_date, end_date, account_ids)
+
+    result = reconcile_operations(file_operations, remote_operations)
+    # Solo cuentan como sobrantes las de los días del archivo, no las del día extra de cada lado
+    result["extra"] = [
+        operation
+        for operation in result["extra"]
+        if file_start <= pd.Timestamp(to_minute_key(operation["date"])) < file_end
+    ]
+
+    columns = list(df.columns)
+    with ResultWriter(
+        f"{base_path}_faltantes", OUTPUT_FORMATS, columns + ["tipo"]
+    ) as missing_writer, ResultWriter(
+        f"{base_path}_sin_mapear", OUTPUT_FORMATS, columns + ["error"]
+    ) as unmapped_writer, ResultWriter(
+        f"{base_path}_sobrantes",
+        OUTPUT_FORMATS,
+        ["id", "tipo", "fecha", "total", "paymentMethodId", "vehicleId", "locationId"],
+    ) as extra_writer, ResultWriter(
+        f"{base_path}_diferencias",
+        OUTPUT_FORMATS,
+        columns + ["tipo", "id", "total_archivo", "total_pulpo"],
+    ) as mismatch_writer:
+        missing_rows = df.iloc[[operation["position"] for operation in result["missing"]]]
+        missing_writer.write_many(
+            missing_rows.assign(
+                tipo=[operation["kind"] for operation in result["missing"]]
+            ).to_dict(orient="records")
+        )
+        write_rows(
+            unmapped_writer,
+            df,
+            [position for position, _ in unmapped],
+            [error for _, error in unmapped],
+        )
+        for operation in result["extra"]:
+            kind, date, payment_method_id, vehicle_id, location_id = operation[
+                "fingerprint"
+            ]
+            extra_writer.write(
+                {
+                    "id": operation["id"],
+                    "tipo": kind,
+                    "fecha": operation["date"],
+                    "total": operation["total"],
+                    "paymentMethodId": payment_method_id,
+                    "vehicleId": vehicle_id,
+                    "locationId": location_id,
+                }
+            )
+        mismatch_rows = df.iloc[
+            [operation["position"] for operation, _ in result["amount_mismatch"]]
+        ]
+        mismatch_writer.write_many(
+            mismatch_rows.assign(
+                tipo=[operation["kind"] for operation, _ in result["amount_mismatch"]],
+                id=[remote["id"] for _, remote in result["amount_mismatch"]],
+                total_archivo=[
+                    operation["total"] for operation, _ in result["amount_mismatch"]
+                ],
+                total_pulpo=[remote["total"] for _, remote in result["amount_mismatch"]],
+            ).to_dict(orient="records")
+        )
+
+    summary = {
+        "archivo": file_name,
+        "filas": len(df),
+        "sin_mapear": len(unmapped),
+        "operaciones_archivo": len(file_operations),
+        "operaciones_pulpo": len(remote_operations),
+        "faltantes": len(result["missing"]),
+        "sobrantes": len(result["extra"]),
+        "diferencias_importe": len(result["amount_mismatch"]),
+        "desde": start_date,
+        "hasta": end_date,
+        "archivos": [
+            path
+            for writer in [missing_writer, unmapped_writer, extra_writer, mismatch_writer]
+            for path in writer.paths
+        ],
+    }
+    ensure_directory_exists(REPORTS_DIR)
+    with open(f"{base_path}.json", "w", encoding="utf-8") as json_file:
+        json.dump(summary, json_file, ensure_ascii=False, indent=2)
+
+    logger.info(
+        f"Conciliación de {file_name}: {summary['faltantes']} faltantes, {summary['sobrantes']} sobrantes, "
+        f"{summary['diferencias_importe']} con diferencias de importe, {summary['sin_mapear']} sin mapear"
+    )
+    logger.info(f"Reporte de conciliación guardado en {base_path}.json")
+    return summary
+
+
+def run_reconcile(file_paths: list):
+    """
+    Modo conciliación: compara cada archivo con las operaciones que ya existen en Pulpo, sin enviar nada.
+    """
+    if len(file_paths) == 0:
+        logger.info(
+            "No hay archivos que conciliar, verifique que hayan en la carpeta de /pending"
+        )
+        return
+
+    master_data = load_master_data()
+    for idx, file_path in enumerate(file_paths, start=1):
+        logger.info(
+            f"Conciliando archivo {os.path.basename(file_path)} ({idx}/{len(file_paths)})"
+        )
+        try:
+            reconcile_file(file_path, master_data)
+        except Exception as e:
+            logger.error(f"Error conciliando archivo {file_path}: {str(e)}")
+
+
+# Script principal
+def main(sources: list = None):
+    """
+    :param sources: archivos locales, carpetas o URIs s3:// a procesar, por defecto la carpeta pending
+    """
+    # Listar archivos en carpeta 'pending' o los indicados por línea de comandos
+    file_paths = expand_sources(sources or [PENDING_DIR])
+    if len(file_paths) == 0:
         logger.info(
             "No hay archivos que procesar, verifique que hayan en la carpeta de /pending"
         )
         return
 
     logger.info("Archivos encontrados para procesar:")
-    for idx, file in enumerate(files, start=1):
-        logger.info(f"{idx} - {file}")
+    for idx, file_path in enumerate(file_paths, start=1):
+        logger.info(f"{idx} - {file_path}")
 
     logger.info("¿Deseas procesar estos archivos? (Y/N): ")
     confirmation = input().strip().upper()
@@ -833,104 +2003,244 @@ def main():
         logger.info("Token no válido, operación cancelada.")
         return
 
-    # Precargamos los datos maestros
-    establ_codes = get_establ_codes_list(files)
-    locations = load_locations(establ_codes)
+    timer = StageTimer()
 
-    vehicles, drivers, payment_methods, fuel_type_of_fuels, expense_types = (
-        get_all_entities()
-    )
+    try:
+        # Precargamos los datos maestros
+        with timer.stage("datos_maestros"):
+            master_data = load_master_data()
+
+        with timer.stage("campos_personalizados"):
+            configure_custom_fields()
+
+        # Procesamiento de archivos, cada archivo se lee una sola vez
+        for idx, file_path in enumerate(file_paths, start=1):
+            file_name = os.path.basename(file_path)
+            logger.info(f"Procesando archivo {file_name} ({idx}/{len(file_paths)})")
+            with timer.stage("lectura", file_name) as stage:
+                df = read_operations(file_path)
+                stage["rows"] = len(df)
+            with timer.stage("establecimientos", file_name) as stage:
+                establ_codes = get_establ_codes(df)
+                stage["rows"] = len(establ_codes)
+                locations = load_locations(establ_codes)
+            process_file(
+                file_path,
+                master_data,
+                locations,
+                running_type == "T",
+                timer=timer,
+                df=df,
+            )
+            logger.info(
+                "Los archivos procesados crudos quedaron en la carpeta /pending"
+            )
+    finally:
+        save_timing_report(timer)
 
-    product_to_expense_types = load_product_to_expense_types()
-    product_to_fuel_types = load_product_to_fuel_types()
 
-    configure_fuels_custom_fields(EXPENSES_CUSTOM_FIELDS_DEFINITION, "expenses")
-    configure_fuels_custom_fields(FUELS_CUSTOM_FIELDS_DEFINITION, "fuels")
+def save_timing_report(timer: StageTimer, prefix: str = "tiempos"):
+    timer.log_summary(logger)
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    report_path = os.path.join(REPORTS_DIR, f"{prefix}_{timestamp}.json")
+    timer.save_json(report_path)
+    logger.info(f"Reporte de tiempos guardado en {report_path}")
 
-    # Procesamiento de archivos
-    for idx, file_name in enumerate(files, start=1):
-        logger.info(f"Procesando archivo {file_name} ({idx}/{len(files)})")
-        file_path = os.path.join(PENDING_DIR, file_name)
-        df = pd.read_excel(file_path, sheet_name=0, dtype=str, keep_default_na=False)
-        total_rows = len(df)
 
-        if total_rows == 0:
-            logger.info(
-                f"No hay nada que procesar en el archivo {file_name}, omitiendo..."
-            )
-            continue
+# Modo servicio
+def load_daemon_config(config_path: str) -> dict:
+    """
+    Lee la configuración del modo servicio, completando los valores por defecto.
+    Las rutas relativas se resuelven desde la carpeta del script.
+    """
+    config = {**DAEMON_DEFAULT_CONFIG, **get_json_from_file(config_path)}
+    if config["mode"] not in ["T", "P"]:
+        raise ValueError(f"Modo '{config['mode']}' no válido, debe ser T o P")
 
-        # Bucle para mapear filas
-        logger.info("Mapeando datos...")
-        fuels = []
-        expenses = []
-        mapped_error = []
-        for row_idx, (_, row) in enumerate(df.iterrows(), start=1):
-            logger.info(f"Mapeando ({row_idx}/{total_rows}) filas")
-            row_dict = row.to_dict()
-            mapping_result = try_to_map_data(
-                row_idx,
-                row_dict,
-                file_name,
-                vehicles,
-                drivers,
-                payment_methods,
-                locations,
-                product_to_fuel_types,
-                fuel_type_of_fuels,
-                product_to_expense_types,
-                expense_types,
-            )
-            if mapping_result["success"]:
-                data = mapping_result["data"]
-                if data["is_fuel"]:
-                    fuels.append({"mapped": data["mapped"], "raw": row_dict})
-                else:
-                    expenses.append({"mapped": data["mapped"], "raw": row_dict})
-            else:
-                row_dict["error"] = mapping_result["error"]
-                mapped_error.append(row_dict)
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    for key in ["watch_dir", "working_dir", "processed_dir", "error_dir"]:
+        config[key] = os.path.join(base_dir, config[key])
+    return config
+
+
+class FolderWatcher:
+    """
+    Espera cambios en una carpeta usando inotify si está disponible (Linux con inotify_simple instalado),
+    si no, hace polling cada poll_interval_seconds.
+    """
 
-        # Si ocurre un error de mapeo genera archivo correspondiente y sigue ejecutando
-        if len(mapped_error) != 0:
-            logger.info("Datos mapeados pero con errores, generando archivo...")
-            save_raw_data(mapped_error, file_name, "mapeo_error", ERROR_DIR)
+    def __init__(self, directory: str, poll_interval_seconds: float):
+        self.directory = directory
+        self.poll_interval_seconds = poll_interval_seconds
+        self.inotify = None
+        try:
+            from inotify_simple import INotify, flags
+
+            self.inotify = INotify()
+            self.inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO)
+            logger.info(f"Vigilando {directory} con inotify")
+        except (ImportError, OSError) as e:
+            logger.info(f"inotify no disponible ({e}), vigilando {directory} con polling")
+
+    def wait(self):
+        if self.inotify is not None:
+            # Aunque no lleguen eventos revisamos la carpeta cada cierto tiempo
+            self.inotify.read(timeout=int(self.poll_interval_seconds * 1000))
         else:
-            logger.info("Datos mapeados exitosamente")
+            time.sleep(self.poll_interval_seconds)
 
-        fuels_len = len(fuels)
-        logger.info(f"Combustibles totales: {fuels_len}")
-        expenses_len = len(expenses)
-        logger.info(f"Gastos totales: {expenses_len}")
 
-        if fuels_len == 0 and expenses_len == 0:
-            raise ValueError(
-                "Hubo un error al obtener registros de combustibles y gastos, por favor verifique los datos y los errores"
-            )
+def claim_pending_files(config: dict) -> list:
+    """
+    Mueve de forma atómica a la carpeta de trabajo los archivos que ya terminaron de escribirse,
+    así un archivo nunca se procesa dos veces ni a medio copiar.
+    """
+    claimed = []
+    now = time.time()
+    for entry in sorted(os.scandir(config["watch_dir"]), key=lambda e: e.name):
+        if not entry.is_file() or not is_operations_file(entry.name):
+            continue
+        if now - entry.stat().st_mtime < config["settle_seconds"]:
+            continue
+        working_path = os.path.join(config["working_dir"], entry.name)
+        try:
+            os.replace(entry.path, working_path)
+        except FileNotFoundError:
+            continue
+        claimed.append(working_path)
+    return claimed
+
+
+def move_to_folder(file_path: str, directory: str):
+    ensure_directory_exists(directory)
+    destination = os.path.join(directory, os.path.basename(file_path))
+    if os.path.exists(destination):
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        destination = os.path.join(
+            directory, f"{timestamp}_{os.path.basename(file_path)}"
+        )
+    os.replace(file_path, destination)
+    logger.info(f"Archivo {os.path.basename(file_path)} movido a {directory}")
 
-        if fuels_len > 0:
-            logger.info("Procesando Combustibles")
-            processed_fuels, error_fuels = process_data(
-                fuels, file_name, True, running_type == "T"
-            )
-            if len(processed_fuels):
-                save_raw_data(processed_fuels, file_name, "combustibles", PROCESSED_DIR)
-            if len(error_fuels) > 0:
-                save_raw_data(error_fuels, file_name, "combustibles_error", ERROR_DIR)
-
-        if expenses_len > 0:
-            logger.info("Procesando Gastos")
-            processed_expenses, error_expenses = process_data(
-                expenses, file_name, False, running_type == "T"
-            )
-            if len(processed_expenses) > 0:
-                save_raw_data(processed_expenses, file_name, "gastos", PROCESSED_DIR)
-            if len(error_expenses) > 0:
-                save_raw_data(error_expenses, file_name, "gastos_error", ERROR_DIR)
 
-        logger.info(f"Archivo {file_name} procesado completamente")
-        logger.info("Los archivos procesados crudos quedaron en la carpeta /pending")
+def run_daemon(config_path: str):
+    """
+    Modo servicio no interactivo: vigila la carpeta de pendientes y procesa cada archivo nuevo
+    con el modo y la concurrencia configurados, manteniendo los datos maestros en memoria.
+    """
+    import signal
+
+    config = load_daemon_config(config_path)
+    if not TOKEN:
+        raise ValueError("Token no válido, revisa BEARER_TOKEN en el .env")
+
+    for directory in ["watch_dir", "working_dir", "processed_dir", "error_dir"]:
+        ensure_directory_exists(config[directory])
+
+    stop_requested = Event()
+
+    def request_stop(signum, frame):
+        logger.info("Deteniendo el servicio al terminar el archivo en curso...")
+        stop_requested.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    # Archivos que quedaron a medias en una ejecución anterior vuelven a la cola
+    for file_name in os.listdir(config["working_dir"]):
+        os.replace(
+            os.path.join(config["working_dir"], file_name),
+            os.path.join(config["watch_dir"], file_name),
+        )
+
+    configure_custom_fields()
+    master_data = None
+    master_data_loaded_at = 0
+    watcher = FolderWatcher(config["watch_dir"], config["poll_interval_seconds"])
+    logger.info(f"Servicio iniciado en modo {config['mode']}")
+
+    while not stop_requested.is_set():
+        for file_path in claim_pending_files(config):
+            if master_data is None or (
+                time.time() - master_data_loaded_at
+                > config["master_data_ttl_seconds"]
+            ):
+                master_data = load_master_data()
+                master_data_loaded_at = time.time()
+
+            timer = StageTimer()
+            file_name = os.path.basename(file_path)
+            try:
+                with timer.stage("lectura", file_name) as stage:
+                    df = read_operations(file_path)
+                    stage["rows"] = len(df)
+                with timer.stage("establecimientos", file_name):
+                    locations = load_locations(get_establ_codes(df))
+                process_file(
+                    file_path,
+                    master_data,
+                    locations,
+                    config["mode"] == "T",
+                    config["max_workers"],
+                    config["preflight_short_circuit"],
+                    timer,
+                    df,
+                )
+                move_to_folder(file_path, config["processed_dir"])
+            except Exception as e:
+                logger.error(f"Error procesando archivo {file_path}: {str(e)}")
+                move_to_folder(file_path, config["error_dir"])
+            save_timing_report(timer)
+
+            if stop_requested.is_set():
+                break
+        if not stop_requested.is_set():
+            watcher.wait()
+
+    logger.info("Servicio detenido")
+
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Carga operaciones de combustibles y gastos de Repsol en Pulpo"
+    )
+    parser.add_argument(
+        "sources",
+        nargs="*",
+        help="Archivos .xls, .xlsx o .csv, carpetas o URIs s3://bucket/key a procesar (por defecto la carpeta pending)",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Ejecuta en modo servicio vigilando la carpeta de pendientes",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Valida los archivos sin enviar nada al API y genera un reporte en reports",
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="Compara los archivos con las operaciones ya cargadas en Pulpo y genera un reporte en reports",
+    )
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(__file__), "daemon.json"),
+        help="Archivo de configuración del modo servicio",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.daemon:
+        run_daemon(args.config)
+    elif args.validate:
+        run_validation(expand_sources(args.sources or [PENDING_DIR]))
+    elif args.reconcile:
+        run_reconcile(expand_sources(args.sources or [PENDING_DIR]))
+    else:
+        main(args.sources)
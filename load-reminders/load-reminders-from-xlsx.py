@@ -9,7 +9,7 @@ import pytz
 import requests
 from dotenv import load_dotenv
 
-from libs import pulpo_api, logger
+from libs import pulpo_api, logger, ResultWriter
 
 # Cargar variables de entorno
 load_dotenv()
@@ -26,6 +26,9 @@ ERROR_DIR = "./error"
 
 MAX_SECONDS_TO_SLEEP = 1
 
+# Formatos de los archivos de resultados, el csv se escribe fila a fila y sobrevive a una caída del script
+OUTPUT_FORMATS = ["csv", "xlsx"]
+
 logging = logger.setup_logger()
 
 # Mapeos para campos específicos
@@ -220,10 +223,12 @@ def process_excel_files():
                     logging.info(f"La hoja '{sheet_name}' está vacía. Omitiendo.")
                     continue
 
-                # Procesar cada fila del archivo
-                processed_rows = []
-                mapping_error_rows = []  # Errores durante el mapeo
-                processing_error_rows = []  # Errores durante el procesamiento con el endpoint
+                # Los resultados se escriben fila a fila a medida que se procesan
+                results_name = file + f"_{sheet_name}"
+                columns = list(df.columns)
+                processed_writer = open_processed_writer(results_name, columns)
+                mapping_error_writer = open_error_writer(results_name, "mapping", columns)  # Errores durante el mapeo
+                processing_error_writer = open_error_writer(results_name, "processing", columns)  # Errores durante el procesamiento con el endpoint
 
                 for index, row in df.iterrows():
                     current_row = index + 1  # Excel comienza en 1, no en 0
@@ -243,60 +248,73 @@ def process_excel_files():
                                     f"Recordatorio creado correctamente: {reminder_id}"
                                 )
                                 
-                                processed_rows.append(
-                                    {
-                                        "id": index + 2,  # +2 para compensar el encabezado y que excel comienza en 1
-                                        "data": reminder_data,
-                                        "original_data": row.to_dict(),  # Guardar datos originales para el reporte
-                                        "sheet_name": sheet_name  # Guardar el nombre de la hoja
-                                    }
+                                processed_writer.write(
+                                    to_processed_record(
+                                        {
+                                            "id": index + 2,  # +2 para compensar el encabezado y que excel comienza en 1
+                                            "data": reminder_data,
+                                            "original_data": row.to_dict(),  # Guardar datos originales para el reporte
+                                            "sheet_name": sheet_name  # Guardar el nombre de la hoja
+                                        }
+                                    )
                                 )
                             except Exception as endpoint_error:
                                 # Error al procesar con el endpoint
                                 logging.error(
                                     f"Error al crear el recordatorio para la fila {index + 2}: {str(endpoint_error)}"
                                 )
-                                processing_error_rows.append(
+                                processing_error_writer.write(
+                                    to_error_record(
+                                        {
+                                            "id": index + 2,
+                                            "error": str(endpoint_error),
+                                            "data": row.to_dict(),
+                                            "mapped_data": reminder_data,
+                                            "sheet_name": sheet_name
+                                        },
+                                        "processing"
+                                    )
+                                )
+                        else:
+                            logging.debug(
+                                f"Datos del recordatorio mapeados correctamente (modo prueba): {reminder_data}"
+                            )
+                            processed_writer.write(
+                                to_processed_record(
                                     {
                                         "id": index + 2,
-                                        "error": str(endpoint_error),
-                                        "data": row.to_dict(),
-                                        "mapped_data": reminder_data,
+                                        "data": reminder_data,
+                                        "original_data": row.to_dict(),  # Guardar datos originales para el reporte
                                         "sheet_name": sheet_name
                                     }
                                 )
-                        else:
-                            logging.info(
-                                f"Datos del recordatorio mapeados correctamente (modo prueba): {reminder_data}"
-                            )
-                            processed_rows.append(
-                                {
-                                    "id": index + 2,
-                                    "data": reminder_data,
-                                    "original_data": row.to_dict(),  # Guardar datos originales para el reporte
-                                    "sheet_name": sheet_name
-                                }
                             )
 
-                        time.sleep(MAX_SECONDS_TO_SLEEP)
+                        # En modo prueba no se llama al API, no hace falta esperar entre filas
+                        if persist_data:
+                            time.sleep(MAX_SECONDS_TO_SLEEP)
 
                     except Exception as mapping_error:
                         # Error durante el mapeo
                         logging.error(
                             f"Error al mapear la fila {index + 2}: {str(mapping_error)}"
                         )
-                        mapping_error_rows.append(
-                            {
-                                "id": index + 2,
-                                "error": str(mapping_error),
-                                "data": row.to_dict(),
-                                "sheet_name": sheet_name
-                            }
+                        mapping_error_writer.write(
+                            to_error_record(
+                                {
+                                    "id": index + 2,
+                                    "error": str(mapping_error),
+                                    "data": row.to_dict(),
+                                    "sheet_name": sheet_name
+                                },
+                                "mapping"
+                            )
                         )
 
-                # Guardar los resultados para esta hoja
-                sheet_suffix = f"_{sheet_name}"
-                save_results(file + sheet_suffix, processed_rows, mapping_error_rows, processing_error_rows)
+                # Cerrar los archivos de resultados y guardar el resumen de esta hoja
+                for writer in [processed_writer, mapping_error_writer, processing_error_writer]:
+                    writer.close()
+                save_results(results_name, processed_writer, mapping_error_writer, processing_error_writer)
                 
                 logging.info(f"Hoja '{sheet_name}' procesada.")
                 logging.info(f"{'=' * 50}")
@@ -521,173 +539,141 @@ def create_reminder(data):
     return response_data["id"]
 
 
-def export_errors_to_excel(file_name, error_rows, error_type):
+def open_error_writer(file_name, error_type, columns):
     """
-    Exporta los errores a un archivo Excel.
-    
+    Abre el writer incremental del reporte de errores.
+
     Args:
         file_name: Nombre del archivo original
-        error_rows: Lista de filas con errores
         error_type: Tipo de error ('mapping' o 'processing')
-    
+        columns: Columnas de la hoja original
+
     Returns:
-        Nombre del archivo generado o None si no hay errores
+        ResultWriter que solo crea el archivo si se escribe algún error
     """
-    if not error_rows:
-        return None  # No hay errores para exportar
-    
-    # Asegurarse de que el directorio de errores existe
-    if not os.path.exists(ERROR_DIR):
-        os.makedirs(ERROR_DIR)
-    
     # Generar nombre de archivo para el reporte de errores
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    
+
     # Determinar el sufijo según el tipo de error
-    suffix = "_mapeo.xlsx" if error_type == "mapping" else "_errors.xlsx"
-    
+    suffix = "_mapeo" if error_type == "mapping" else "_errors"
+
     error_file_name = os.path.join(ERROR_DIR, f"{timestamp}_{os.path.splitext(file_name)[0]}{suffix}")
-    
-    # Preparar los datos para el archivo Excel - Usar los datos originales
-    error_data = []
-    for error_row in error_rows:
-        # Usar los datos originales de la fila del Excel
-        row_data = error_row["data"].copy()  # Los datos originales están en "data"
-        
-        # Añadir información sobre el error
-        row_data["Error"] = error_row["error"]
-        row_data["Fila"] = error_row["id"]
-        
-        # Añadir el nombre de la hoja si está disponible
-        if "sheet_name" in error_row:
-            row_data["Hoja"] = error_row["sheet_name"]
-        
-        # Si es un error de procesamiento y queremos añadir alguna info del JSON mapeado
-        if error_type == "processing" and "mapped_data" in error_row:
-            # Añadir solo el ID del recordatorio si existe (para referencia)
-            if "id" in error_row["mapped_data"]:
-                row_data["ID_Recordatorio"] = error_row["mapped_data"]["id"]
-            
-            # Opcionalmente podríamos añadir otra info clave del mapeo
-            # row_data["JSON_Procesado"] = str(error_row["mapped_data"])
-                
-        error_data.append(row_data)
-    
-    # Crear el DataFrame y guardar como Excel
-    error_df = pd.DataFrame(error_data)
-    error_df.to_excel(error_file_name, index=False)
-    
-    logging.info(f"Archivo de errores {'de mapeo' if error_type == 'mapping' else 'de procesamiento'} creado: {error_file_name}")
-    return error_file_name
 
+    error_columns = columns + ["Error", "Fila", "Hoja"]
+    if error_type == "processing":
+        error_columns.append("ID_Recordatorio")
 
-def export_processed_to_excel(file_name, processed_rows):
+    return ResultWriter(error_file_name, OUTPUT_FORMATS, error_columns)
+
+
+def to_error_record(error_row, error_type):
     """
-    Exporta las filas procesadas exitosamente a un archivo Excel en la carpeta processed.
-    
+    Convierte una fila con error en el registro del reporte, usando los datos originales de la fila.
+    """
+    row_data = error_row["data"].copy()  # Los datos originales están en "data"
+
+    # Añadir información sobre el error
+    row_data["Error"] = error_row["error"]
+    row_data["Fila"] = error_row["id"]
+
+    # Añadir el nombre de la hoja si está disponible
+    if "sheet_name" in error_row:
+        row_data["Hoja"] = error_row["sheet_name"]
+
+    # Si es un error de procesamiento y queremos añadir alguna info del JSON mapeado
+    if error_type == "processing" and "mapped_data" in error_row:
+        # Añadir solo el ID del recordatorio si existe (para referencia)
+        if "id" in error_row["mapped_data"]:
+            row_data["ID_Recordatorio"] = error_row["mapped_data"]["id"]
+
+    return row_data
+
+
+def open_processed_writer(file_name, columns):
+    """
+    Abre el writer incremental de las filas procesadas exitosamente en la carpeta processed.
+
     Args:
         file_name: Nombre del archivo original
-        processed_rows: Lista de filas procesadas exitosamente
-    
+        columns: Columnas de la hoja original
+
     Returns:
-        Nombre del archivo generado o None si no hay filas procesadas
+        ResultWriter que solo crea el archivo si se escribe alguna fila
     """
-    if not processed_rows:
-        return None  # No hay filas procesadas para exportar
-    
-    # Asegurarse de que el directorio processed existe
-    if not os.path.exists(PROCESSED_DIR):
-        os.makedirs(PROCESSED_DIR)
-    
     # Generar nombre de archivo para el reporte de filas procesadas
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    processed_file_name = os.path.join(PROCESSED_DIR, f"{timestamp}_{os.path.splitext(file_name)[0]}_processed.xlsx")
-    
-    # Preparar los datos para el archivo Excel - Usar los datos originales
-    processed_data = []
-    for row in processed_rows:
-        # Usar los datos originales de la fila del Excel
-        if "original_data" in row and row["original_data"]:
-            row_data = row["original_data"].copy()
-        else:
-            # Fallback a los datos procesados si no hay originales
-            row_data = {}
-            
-        # Añadir información adicional
-        row_data["Fila_Original"] = row["id"]
-        
-        # Añadir el ID del recordatorio creado (si existe)
-        if "data" in row and "id" in row["data"]:
-            row_data["ID_Recordatorio"] = row["data"]["id"]
-        
-        # Añadir el nombre de la hoja si está disponible
-        if "sheet_name" in row:
-            row_data["Hoja"] = row["sheet_name"]
-            
-        processed_data.append(row_data)
-    
-    # Crear el DataFrame y guardar como Excel
-    processed_df = pd.DataFrame(processed_data)
-    processed_df.to_excel(processed_file_name, index=False)
-    
-    logging.info(f"Archivo de registros procesados creado: {processed_file_name}")
-    return processed_file_name
+    processed_file_name = os.path.join(PROCESSED_DIR, f"{timestamp}_{os.path.splitext(file_name)[0]}_processed")
+
+    return ResultWriter(
+        processed_file_name, OUTPUT_FORMATS, columns + ["Fila_Original", "ID_Recordatorio", "Hoja"]
+    )
+
+
+def to_processed_record(row):
+    """
+    Convierte una fila procesada en el registro del reporte, usando los datos originales de la fila.
+    """
+    # Usar los datos originales de la fila del Excel
+    if "original_data" in row and row["original_data"]:
+        row_data = row["original_data"].copy()
+    else:
+        # Fallback a los datos procesados si no hay originales
+        row_data = {}
+
+    # Añadir información adicional
+    row_data["Fila_Original"] = row["id"]
+
+    # Añadir el ID del recordatorio creado (si existe)
+    if "data" in row and "id" in row["data"]:
+        row_data["ID_Recordatorio"] = row["data"]["id"]
+
+    # Añadir el nombre de la hoja si está disponible
+    if "sheet_name" in row:
+        row_data["Hoja"] = row["sheet_name"]
 
+    return row_data
 
-def save_results(file, processed_rows, mapping_error_rows, processing_error_rows=None):
+
+def save_results(file, processed_writer, mapping_error_writer, processing_error_writer):
     """
-    Guarda los resultados del procesamiento en un archivo JSON y exporta los errores a archivos Excel.
+    Guarda el resumen del procesamiento en un archivo JSON con los conteos y los archivos generados.
+    Las filas ya quedaron escritas en los reportes de procesados y errores.
     """
     import json
-    
+
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     results = {
         "file": file,
         "timestamp": timestamp,
-        "processed": len(processed_rows),
-        "mapping_errors": len(mapping_error_rows),
-        "processing_errors": len(processing_error_rows) if processing_error_rows else 0,
-        "processed_rows": processed_rows,
-        "mapping_error_rows": mapping_error_rows,
-        "processing_error_rows": processing_error_rows if processing_error_rows else [],
+        "processed": processed_writer.count,
+        "mapping_errors": mapping_error_writer.count,
+        "processing_errors": processing_error_writer.count,
+        "processed_files": processed_writer.paths,
+        "mapping_error_files": mapping_error_writer.paths,
+        "processing_error_files": processing_error_writer.paths,
     }
-    
+
     if not os.path.exists(LOG_DIR):
         os.makedirs(LOG_DIR)
-    
-    # Guardar resultados en JSON
+
+    # Guardar resumen en JSON
     with open(os.path.join(LOG_DIR, f"{timestamp}_{file}.json"), "w") as f:
         json.dump(results, f, indent=2, default=str)
-    
-    # Exportar errores de mapeo a Excel si hay errores
-    mapping_error_file = None
-    if mapping_error_rows:
-        mapping_error_file = export_errors_to_excel(file, mapping_error_rows, "mapping")
-    
-    # Exportar errores de procesamiento a Excel si hay errores
-    processing_error_file = None
-    if processing_error_rows and len(processing_error_rows) > 0:
-        processing_error_file = export_errors_to_excel(file, processing_error_rows, "processing")
-    
-    # Exportar filas procesadas exitosamente a Excel
-    processed_file = None
-    if processed_rows:
-        processed_file = export_processed_to_excel(file, processed_rows)
-    
+
     logging.info(
-        f"Procesamiento completado. Procesados: {len(processed_rows)}, "
-        f"Errores de mapeo: {len(mapping_error_rows)}, "
-        f"Errores de procesamiento: {len(processing_error_rows) if processing_error_rows else 0}"
+        f"Procesamiento completado. Procesados: {processed_writer.count}, "
+        f"Errores de mapeo: {mapping_error_writer.count}, "
+        f"Errores de procesamiento: {processing_error_writer.count}"
     )
-    
-    if mapping_error_file:
-        logging.info(f"Los errores de mapeo se han exportado a: {mapping_error_file}")
-    
-    if processing_error_file:
-        logging.info(f"Los errores de procesamiento se han exportado a: {processing_error_file}")
-    
-    if processed_file:
-        logging.info(f"Los registros procesados se han exportado a: {processed_file}")
+
+    if mapping_error_writer.paths:
+        logging.info(f"Los errores de mapeo se han exportado a: {', '.join(mapping_error_writer.paths)}")
+
+    if processing_error_writer.paths:
+        logging.info(f"Los errores de procesamiento se han exportado a: {', '.join(processing_error_writer.paths)}")
+
+    if processed_writer.paths:
+        logging.info(f"Los registros procesados se han exportado a: {', '.join(processed_writer.paths)}")
 
 
 if __name__ == "__main__":
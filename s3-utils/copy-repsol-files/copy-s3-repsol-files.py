@@ -1,15 +1,44 @@
+import math
 import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from libs import find_matching_files
 
 # Configuración de conexión a S3
-s3_client = boto3.client('s3')
 bucket_name = 'sftp-getpulpo-eu-production'
 processed_path = 'Repsol/processed/'
 to_reprocess_path = 'Repsol/to-reprocess/'
 
+# Subcarpetas que se listan a la vez al buscar archivos
+LIST_WORKERS = 16
+# False: se generan las carpetas dd-mm-yyyy/ del rango directamente. True: se listan todas las carpetas de
+# processed_path y se filtran por fecha, por si alguna carpeta no sigue exactamente ese formato
+DISCOVER_FOLDERS = False
+
+# Copias en paralelo (todas dentro de S3, los datos no pasan por esta máquina)
+COPY_WORKERS = 16
+# A partir de este tamaño se copia por partes con upload_part_copy (copy_object no admite más de 5 GB)
+MULTIPART_THRESHOLD = 1024 * 1024 * 1024
+PART_SIZE = 256 * 1024 * 1024
+# Partes que se copian a la vez entre todos los archivos grandes (un único pool compartido)
+PART_WORKERS = 8
+# S3 admite como máximo 10000 partes por objeto
+MAX_PARTS = 10000
+# Metadato con el ETag del origen, las copias por partes tienen un ETag distinto al del archivo original
+SOURCE_ETAG_METADATA = 'source-etag'
+
+# Una conexión por hilo: con el pool por defecto de botocore (10) los hilos de más descartan y reabren conexiones
+s3_client = boto3.client(
+    's3', config=Config(max_pool_connections=max(LIST_WORKERS, COPY_WORKERS + PART_WORKERS))
+)
+
 # Expresiones regulares para buscar archivos
 patterns = {
     "operaciones_liquidadas": re.compile(r"operaciones_combustible_liquidadas|operaciones_otros_liquidadas"),
@@ -22,54 +51,139 @@ subfolders = {
     "delta_tarjetas": ["REPSOL_PAYMENT_METHODS"]
 }
 
-# Configuración de rango de fechas
-def is_within_date_range(folder_name, start_date, end_date):
-    """Verificar si el nombre de la carpeta es una fecha válida y está dentro del rango."""
+def head_object_or_none(bucket, key):
+    """Metadatos del objeto, o None si no existe."""
     try:
-        folder_date = datetime.strptime(folder_name, '%d-%m-%Y')
-        return start_date <= folder_date <= end_date
-    except ValueError:
+        return s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+def is_already_copied(file, destination):
+    """El destino tiene el mismo tamaño y el mismo ETag que el origen (directo o guardado en metadatos)."""
+    if destination is None or destination['ContentLength'] != file['Size']:
         return False
+    source_etag = file['ETag'].strip('"')
+    return (
+        destination['ETag'].strip('"') == source_etag
+        or destination.get('Metadata', {}).get(SOURCE_ETAG_METADATA) == source_etag
+    )
 
-def list_folders(bucket, prefix):
-    """Listar carpetas en la ruta especificada."""
-    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter='/')
-    return [content.get('Prefix') for content in response.get('CommonPrefixes', [])]
-
-def list_files(bucket, prefix):
-    """Listar archivos en una carpeta especificada."""
-    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-    return [
-        {'Key': content['Key'], 'Size': content['Size']}
-        for content in response.get('Contents', []) if content['Key'].endswith('.csv')
-    ]
-
-def find_matching_files(bucket, prefix, pattern, subfolder_list, start_date, end_date):
-    """Buscar archivos que coincidan con los patrones en carpetas dentro del rango de fechas."""
-    matching_files = []
-    folders = list_folders(bucket, prefix)
-
-    for folder in folders:
-        folder_name = folder.replace(prefix, '').strip('/')
-        if is_within_date_range(folder_name, start_date, end_date):
-            for subfolder in subfolder_list:
-                subfolder_prefix = f"{folder}{subfolder}/"
-                files = list_files(bucket, subfolder_prefix)
-                for file in files:
-                    file_key = file['Key']
-                    if pattern.search(file_key):
-                        matching_files.append(file)
-    return matching_files
-
-def copy_file(bucket, source_key, destination_prefix):
-    """Copiar archivo a la carpeta de reprocesamiento."""
-    destination_key = f"{destination_prefix}{source_key.split('/')[-1]}"
-    s3_client.copy_object(
+def multipart_copy(bucket, file, destination_key, part_size=PART_SIZE, part_executor=None):
+    """
+    Copia un objeto grande por partes en paralelo con upload_part_copy.
+
+    :param part_executor: pool donde se copian las partes, compartido entre archivos para no multiplicar
+        las peticiones a la vez; si no se indica se crea uno de PART_WORKERS hilos solo para este archivo.
+    """
+    source = s3_client.head_object(Bucket=bucket, Key=file['Key'])
+    size = source['ContentLength']
+    part_size = max(part_size, math.ceil(size / MAX_PARTS))
+    metadata = {**source.get('Metadata', {}), SOURCE_ETAG_METADATA: source['ETag'].strip('"')}
+
+    upload = s3_client.create_multipart_upload(
         Bucket=bucket,
-        CopySource={'Bucket': bucket, 'Key': source_key},
-        Key=destination_key
+        Key=destination_key,
+        ContentType=source.get('ContentType', 'binary/octet-stream'),
+        Metadata=metadata,
     )
+
+    def copy_part(part_number):
+        first_byte = (part_number - 1) * part_size
+        last_byte = min(first_byte + part_size, size) - 1
+        response = s3_client.upload_part_copy(
+            Bucket=bucket,
+            Key=destination_key,
+            UploadId=upload['UploadId'],
+            PartNumber=part_number,
+            CopySource={'Bucket': bucket, 'Key': file['Key']},
+            CopySourceRange=f"bytes={first_byte}-{last_byte}",
+        )
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+    try:
+        part_numbers = range(1, math.ceil(size / part_size) + 1)
+        if part_executor is None:
+            with ThreadPoolExecutor(max_workers=PART_WORKERS) as executor:
+                parts = list(executor.map(copy_part, part_numbers))
+        else:
+            parts = list(part_executor.map(copy_part, part_numbers))
+        s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=destination_key,
+            UploadId=upload['UploadId'],
+            MultipartUpload={'Parts': parts},
+        )
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=destination_key, UploadId=upload['UploadId'])
+        raise
+
+def copy_file(bucket, file, destination_prefix, multipart_threshold=MULTIPART_THRESHOLD, part_executor=None):
+    """
+    Copiar archivo a la carpeta de reprocesamiento, salvo que ya esté copiado.
+
+    :return: "copiado" u "omitido"
+    """
+    source_key = file['Key']
+    destination_key = f"{destination_prefix}{source_key.split('/')[-1]}"
+
+    if is_already_copied(file, head_object_or_none(bucket, destination_key)):
+        print(f"Archivo ya copiado, se omite: {destination_key}")
+        return "omitido"
+
+    if file['Size'] >= multipart_threshold:
+        multipart_copy(bucket, file, destination_key, part_executor=part_executor)
+    else:
+        s3_client.copy_object(
+            Bucket=bucket,
+            CopySource={'Bucket': bucket, 'Key': source_key},
+            Key=destination_key
+        )
     print(f"Archivo copiado: {source_key} -> {destination_key}")
+    return "copiado"
+
+def copy_files(bucket, files, destination_prefix, max_workers=COPY_WORKERS):
+    """
+    Copia los archivos en paralelo y muestra un resumen con los archivos copiados, omitidos y con error,
+    y la velocidad de la copia.
+
+    :return: resumen con copiados, omitidos, errores, bytes copiados y segundos.
+    """
+    summary = {"copiado": 0, "omitido": 0, "error": 0, "bytes": 0}
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    # Las partes de los archivos grandes van a un pool aparte: sus hilos nunca esperan a otras tareas,
+    # así no se bloquean los hilos de los archivos que esperan a sus partes
+    with ThreadPoolExecutor(max_workers=PART_WORKERS) as part_executor, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(copy_file, bucket, file, destination_prefix, part_executor=part_executor): file
+            for file in files
+        }
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error al copiar {file['Key']}: {e}")
+                result = "error"
+            with lock:
+                summary[result] += 1
+                if result == "copiado":
+                    summary["bytes"] += file['Size']
+
+    summary["segundos"] = time.perf_counter() - start
+    seconds = max(summary["segundos"], 1e-9)
+    print(
+        f"\nCopiados: {summary['copiado']}, ya copiados: {summary['omitido']}, con error: {summary['error']}"
+    )
+    print(
+        f"{format_size(summary['bytes']):.2f} MB en {summary['segundos']:.2f} s "
+        f"({format_size(summary['bytes']) / seconds:.2f} MB/s, {summary['copiado'] / seconds:.1f} archivos/s)"
+    )
+    return summary
 
 def format_size(size_in_bytes):
     """Convertir tamaño de bytes a MB y formatear."""
@@ -107,7 +221,10 @@ def main():
     # Buscar archivos dentro del rango de fechas
     pattern = patterns[selected_type]
     subfolder_list = subfolders[selected_type]
-    matching_files = find_matching_files(bucket_name, processed_path, pattern, subfolder_list, start_date, end_date)
+    matching_files = find_matching_files(
+        s3_client, bucket_name, processed_path, pattern, subfolder_list, start_date, end_date,
+        discover=DISCOVER_FOLDERS, max_workers=LIST_WORKERS,
+    )
 
     if not matching_files:
         print("No se encontraron archivos que coincidan con los patrones.")
@@ -131,8 +248,7 @@ def main():
         sys.exit()
 
     # Copiar archivos a la carpeta de reprocesamiento
-    for file in matching_files:
-        copy_file(bucket_name, file['Key'], to_reprocess_path)
+    copy_files(bucket_name, matching_files, to_reprocess_path)
 
     print("\nProceso completado.")
 
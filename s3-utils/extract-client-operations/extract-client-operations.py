@@ -11,13 +11,23 @@ from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 
 import boto3
+from botocore.config import Config
+from libs import find_matching_files
 
 # Configuración de conexión a S3
-s3_client = boto3.client('s3')
 bucket_name = 'sftp-getpulpo-eu-production'
 processed_path = 'Repsol/processed/'
 to_reprocess_path = 'Repsol/to-reprocess/'
 
+# Subcarpetas que se listan a la vez al buscar archivos
+LIST_WORKERS = 16
+# False: se generan las carpetas dd-mm-yyyy/ del rango directamente. True: se listan todas las carpetas de
+# processed_path y se filtran por fecha, por si alguna carpeta no sigue exactamente ese formato
+DISCOVER_FOLDERS = False
+
+# Un hilo por conexión: con el pool por defecto de botocore (10) los hilos de más descartan y reabren conexiones
+s3_client = boto3.client('s3', config=Config(max_pool_connections=LIST_WORKERS))
+
 # Ruta para el archivo consolidado
 processed_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processed')
 
@@ -42,45 +52,6 @@ subfolders = {
     "delta_tarjetas": ["REPSOL_PAYMENT_METHODS"]
 }
 
-# Configuración de rango de fechas
-def is_within_date_range(folder_name, start_date, end_date):
-    """Verificar si el nombre de la carpeta es una fecha válida y está dentro del rango."""
-    try:
-        folder_date = datetime.strptime(folder_name, '%d-%m-%Y')
-        return start_date <= folder_date <= end_date
-    except ValueError:
-        return False
-
-def list_folders(bucket, prefix):
-    """Listar carpetas en la ruta especificada."""
-    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter='/')
-    return [content.get('Prefix') for content in response.get('CommonPrefixes', [])]
-
-def list_files(bucket, prefix):
-    """Listar archivos en una carpeta especificada."""
-    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-    return [
-        {'Key': content['Key'], 'Size': content['Size']}
-        for content in response.get('Contents', []) if content['Key'].endswith('.csv')
-    ]
-
-def find_matching_files(bucket, prefix, pattern, subfolder_list, start_date, end_date):
-    """Buscar archivos que coincidan con los patrones en carpetas dentro del rango de fechas."""
-    matching_files = []
-    folders = list_folders(bucket, prefix)
-
-    for folder in folders:
-        folder_name = folder.replace(prefix, '').strip('/')
-        if is_within_date_range(folder_name, start_date, end_date):
-            for subfolder in subfolder_list:
-                subfolder_prefix = f"{folder}{subfolder}/"
-                files = list_files(bucket, subfolder_prefix)
-                for file in files:
-                    file_key = file['Key']
-                    if pattern.search(file_key):
-                        matching_files.append(file)
-    return matching_files
-
 def load_accounts_filter():
     """Cargar los IDs de cuenta desde el archivo accounts.json."""
     try:
@@ -480,7 +451,10 @@ def main():
     # Buscar archivos dentro del rango de fechas
     pattern = patterns[selected_type]
     subfolder_list = subfolders[selected_type]
-    matching_files = find_matching_files(bucket_name, processed_path, pattern, subfolder_list, start_date, end_date)
+    matching_files = find_matching_files(
+        s3_client, bucket_name, processed_path, pattern, subfolder_list, start_date, end_date,
+        discover=DISCOVER_FOLDERS, max_workers=LIST_WORKERS,
+    )
 
     if not matching_files:
         print("No se encontraron archivos que coincidan con los patrones.")
@@ -6,7 +6,7 @@ from datetime import datetime
 import pandas as pd
 from dotenv import load_dotenv
 
-from libs import pulpo_api, logger
+from libs import pulpo_api, logger, ResultWriter
 
 # Cargar variables de entorno
 load_dotenv()
@@ -22,6 +22,9 @@ ERROR_DIR = "./error"
 
 MAX_SECONDS_TO_SLEEP = 1
 
+# Formatos de los archivos de resultados, el csv se escribe fila a fila y sobrevive a una caída del script
+OUTPUT_FORMATS = ["csv", "xlsx"]
+
 logging = logger.setup_logger()
 
 # Listas de referencia
@@ -139,7 +142,9 @@ def process_excel_files():
                 file_path = os.path.join(PENDING_DIR, file)
                 logging.info(f"Procesando archivo: {file}")
                 df = pd.ExcelFile(file_path).parse("INSURANCES")
-                processed_rows, error_rows = [], []
+                processed_writer, error_writer = open_result_writers(
+                    file, list(df.columns) + ["map_error"]
+                )
                 total_rows = len(df)
 
                 for row_idx, (_, row) in enumerate(df.iterrows(), start=1):
@@ -158,11 +163,11 @@ def process_excel_files():
                             logging.info(
                                 "Procesando en modo test, omitiendo envío del vehículo"
                             )
-                            print(vehicle_id, mapped_data)
+                            logging.debug(f"{vehicle_id} {mapped_data}")
                         else:
                             update_vehicle(vehicle_id, mapped_data)
 
-                        processed_rows.append(mapped_data)
+                        processed_writer.write(mapped_data)
 
                         logging.info(
                             f"({row_idx}/{total_rows}) Vehículo {vehicle_id} actualizado. Esperando {MAX_SECONDS_TO_SLEEP} segundos para continuar."
@@ -172,9 +177,9 @@ def process_excel_files():
                             time.sleep(MAX_SECONDS_TO_SLEEP)
                     except Exception as e:
                         row["map_error"] = str(e)
-                        error_rows.append(row)
+                        error_writer.write(row.to_dict())
 
-                save_results(file, processed_rows, error_rows)
+                save_results(processed_writer, error_writer)
             except Exception as e:
                 logging.error(f"Error procesando archivo {file}: {str(e)}")
 
@@ -317,19 +322,29 @@ def update_vehicle(vehicle_id, data):
         raise ValueError(f"Error: {response.status_code} {response.text}")
 
 
-# Función para guardar resultados
-def save_results(file, processed_rows, error_rows):
+# Función para abrir los archivos de resultados, se escriben fila a fila a medida que se procesan
+def open_result_writers(file, error_columns):
     file_name, _ = os.path.splitext(file)
 
-    if processed_rows:
-        processed_path = os.path.join(PROCESSED_DIR, f"{file_name}_processed.xlsx")
-        pd.DataFrame(processed_rows).to_excel(processed_path, index=False)
-        logging.info(f"Archivo procesado guardado en {processed_path}")
+    processed_writer = ResultWriter(
+        os.path.join(PROCESSED_DIR, f"{file_name}_processed"), OUTPUT_FORMATS
+    )
+    error_writer = ResultWriter(
+        os.path.join(ERROR_DIR, f"{file_name}_map_error"), OUTPUT_FORMATS, error_columns
+    )
+    return processed_writer, error_writer
+
+
+# Función para guardar resultados
+def save_results(processed_writer, error_writer):
+    processed_writer.close()
+    error_writer.close()
+
+    if processed_writer.paths:
+        logging.info(f"Archivo procesado guardado en {', '.join(processed_writer.paths)}")
 
-    if error_rows:
-        error_path = os.path.join(ERROR_DIR, f"{file_name}_map_error.xlsx")
-        pd.DataFrame(error_rows).to_excel(error_path, index=False)
-        logging.warning(f"Errores guardados en {error_path}")
+    if error_writer.paths:
+        logging.warning(f"Errores guardados en {', '.join(error_writer.paths)}")
 
 
 # Función principal
@@ -11,7 +11,7 @@ import pytz
 import requests
 from dotenv import load_dotenv
 
-from libs import pulpo_api, logger
+from libs import pulpo_api, logger, ResultWriter
 
 # Cargar variables de entorno
 load_dotenv()
@@ -27,6 +27,9 @@ ERROR_DIR = "./error"
 
 MAX_SECONDS_TO_SLEEP = 1
 
+# Formatos de los archivos de resultados, el csv se escribe fila a fila y sobrevive a una caída del script
+OUTPUT_FORMATS = ["csv", "xlsx"]
+
 logging = logger.setup_logger()
 
 # Listas de referencia
@@ -226,7 +229,9 @@ def process_excel_files():
             df["Fecha fin"], format="%Y-%m-%d %H:%M:%S", errors="coerce"
         )
         df = df.sort_values(by="Fecha fin", ascending=True)
-        processed_rows, error_rows = [], []
+        processed_writer, error_writer = open_result_writers(
+            file_name, list(df.columns) + ["map_error"]
+        )
         total_rows = len(df)
 
         for row_idx, (_, row) in enumerate(df.iterrows(), start=1):
@@ -249,7 +254,7 @@ def process_excel_files():
                     logging.info(
                         "Procesando en modo test, omitiendo envío del vehículo"
                     )
-                    print(vehicle_id, vehicle_renting_mapped_data)
+                    logging.debug(f"{vehicle_id} {vehicle_renting_mapped_data}")
                 else:
                     update_vehicle(vehicle_id, vehicle_renting_mapped_data)
 
@@ -262,7 +267,7 @@ def process_excel_files():
                         logging.info(
                             "Procesando en modo test, omitiendo envío del gasto programado"
                         )
-                        print(scheduled_expense_mapped_data)
+                        logging.debug(scheduled_expense_mapped_data)
                     else:
                         create_scheduled_expense(scheduled_expense_mapped_data)
 
@@ -273,13 +278,13 @@ def process_excel_files():
                         f"Esperando {MAX_SECONDS_TO_SLEEP} segundos para continuar."
                     )
                     time.sleep(MAX_SECONDS_TO_SLEEP)
-                processed_rows.append(vehicle_renting_mapped_data)
+                processed_writer.write(vehicle_renting_mapped_data)
             except Exception as e:
                 row["map_error"] = str(e)
                 logging.error(f"Error encontrado, {str(e)}")
-                error_rows.append(row)
+                error_writer.write(row.to_dict())
 
-        save_results(file, processed_rows, error_rows)
+        save_results(processed_writer, error_writer)
 
 
 # Función de mapeo
@@ -597,19 +602,29 @@ def create_scheduled_expense(data):
         raise ValueError(f"Error: {response.status_code} {response.text}")
 
 
-# Función para guardar resultados
-def save_results(file, processed_rows, error_rows):
+# Función para abrir los archivos de resultados, se escriben fila a fila a medida que se procesan
+def open_result_writers(file, error_columns):
     file_name, _ = os.path.splitext(file)
 
-    if processed_rows:
-        processed_path = os.path.join(PROCESSED_DIR, f"{file_name}_processed.xlsx")
-        pd.DataFrame(processed_rows).to_excel(processed_path, index=False)
-        logging.info(f"Archivo procesado guardado en {processed_path}")
+    processed_writer = ResultWriter(
+        os.path.join(PROCESSED_DIR, f"{file_name}_processed"), OUTPUT_FORMATS
+    )
+    error_writer = ResultWriter(
+        os.path.join(ERROR_DIR, f"{file_name}_map_error"), OUTPUT_FORMATS, error_columns
+    )
+    return processed_writer, error_writer
+
+
+# Función para guardar resultados
+def save_results(processed_writer, error_writer):
+    processed_writer.close()
+    error_writer.close()
+
+    if processed_writer.paths:
+        logging.info(f"Archivo procesado guardado en {', '.join(processed_writer.paths)}")
 
-    if error_rows:
-        error_path = os.path.join(ERROR_DIR, f"{file_name}_map_error.xlsx")
-        pd.DataFrame(error_rows).to_excel(error_path, index=False)
-        logging.warning(f"Errores guardados en {error_path}")
+    if error_writer.paths:
+        logging.warning(f"Errores guardados en {', '.join(error_writer.paths)}")
 
 
 # Función principal